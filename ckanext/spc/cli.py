@@ -14,7 +14,9 @@ from alembic import command
 from alembic.config import Config
 
 from ckan.common import config
-from ckanext.spc.jobs import broken_links_report
+from ckanext.spc.jobs import (
+    broken_links_report, update_ga_view_counts, refresh_drupal_footer
+)
 import ckan.lib.jobs as jobs
 import ckan.lib.search as search
 
@@ -186,6 +188,21 @@ def broken_links_report():
     jobs.enqueue(broken_links_report, timeout=7200)
 
 
+@spc.command('update_ga_view_counts')
+def update_ga_views():
+    updated = update_ga_view_counts()
+    click.secho('{} packages were reindexed'.format(updated), fg='green')
+
+
+@spc.command('refresh_footer')
+def refresh_footer():
+    drupal_url = config.get('drupal.site_url')
+    if not drupal_url:
+        click.secho('drupal.site_url is not configured', fg='red')
+        return
+    refresh_drupal_footer(drupal_url)
+
+
 @spc.command('fix_harvester_duplications')
 @click.argument(u'drop_source', required=True)
 def fix_harvester_duplications(drop_source):
@@ -10,10 +10,7 @@ from ckan.lib.munge import munge_title_to_name, munge_tag
 import ckan.plugins.toolkit as tk
 
 from ckanext.oaipmh.harvester import OaipmhHarvester
-from ckanext.scheming.helpers import (
-    scheming_get_dataset_schema, scheming_field_by_name, scheming_field_choices
-)
-from ckanext.spc.utils import eez
+from ckanext.spc.utils import eez, member_countries
 
 logger = logging.getLogger(__name__)
 
@@ -55,26 +52,17 @@ class SpcOaipmhHarvester(OaipmhHarvester):
 
         coverage = package_dict.pop('coverage', None)
         if coverage:
-            schema = scheming_get_dataset_schema('publications')
-            field = scheming_field_by_name(
-                schema['dataset_fields'], 'member_countries'
+            package_dict['member_countries'] = member_countries(
+                coverage, 'publications'
             )
-            choices = scheming_field_choices(field)
-            package_dict['member_countries'] = [
-                choice['value'] for choice in choices
-                if choice['label'] in coverage
-            ] or ['other']
-            polygons = [
-                t['geometry'] for t in eez.collection if any(
-                    country in t['properties']['GeoName']
-                    for country in coverage
-                )
-            ]
+            features = eez.features_by_names(coverage)
             # TODO: for now we are taking first polygon from possible
             # list because of SOLR restriction of spatial field
             # size. In future we may add additional logic here
-            if polygons:
-                package_dict['coverage'] = json.dumps(polygons[0])
+            if features:
+                polygon = eez.simplified_geometry(features[0])
+                if polygon:
+                    package_dict['coverage'] = polygon
 
         return package_dict
 
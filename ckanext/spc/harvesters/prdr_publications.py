@@ -14,10 +14,7 @@ from ckan import model
 from ckanext.harvest.harvesters import HarvesterBase
 from ckanext.harvest.model import HarvestObject, HarvestObjectExtra
 
-from ckanext.scheming.helpers import (
-    scheming_get_dataset_schema, scheming_field_by_name, scheming_field_choices
-)
-from ckanext.spc.utils import eez
+from ckanext.spc.utils import eez, member_countries
 
 log = logging.getLogger(__name__)
 NotFound = logic.NotFound
@@ -399,29 +396,19 @@ class PRDRPublicationsHarvester(HarvesterBase):
             'ignore_auth': True,
         }
 
-        package_schema = scheming_get_dataset_schema('publications')
-        field = scheming_field_by_name(
-            package_schema['dataset_fields'], 'member_countries'
+        mem_temp_list = [x for x in package_dict['member_countries'] if x is not None]
+        package_dict['member_countries'] = member_countries(
+            mem_temp_list, 'publications'
         )
-        choices = scheming_field_choices(field)
 
-        mem_temp_list = [x for x in package_dict['member_countries'] if x is not None]
-        package_dict['member_countries'] = [
-            choice['value'] for choice in choices
-            if choice['label'] in mem_temp_list
-        ] or ['other']
-
-        polygons = [
-            t['geometry'] for t in eez.collection if any(
-                country in t['properties']['GeoName']
-                for country in mem_temp_list
-            )
-        ]
+        features = eez.features_by_names(mem_temp_list)
         # TODO: for now we are taking first polygon from possible
         # list because of SOLR restriction of spatial field
         # size. In future we may add additional logic here
-        if polygons:
-            package_dict['coverage'] = json.dumps(polygons[0])
+        if features:
+            polygon = eez.simplified_geometry(features[0])
+            if polygon:
+                package_dict['coverage'] = polygon
 
         if status == 'new':
             # context['schema'] = package_schema
@@ -1,22 +1,24 @@
 import json
 from urllib.parse import urlparse, urlunparse
 import logging
-import requests
 import iso639
 
 from operator import eq, itemgetter
-from beaker.cache import CacheManager
+from flask import g, has_app_context
 import funcy as F
 from routes import url_for as _routes_default_url_for
 
 from ckan.common import config
 
-from ckanext.spc.utils import eez
+from ckanext.spc.utils import drupal_footer, eez, org_cache
 import ckan.lib.helpers as h
+import ckan.lib.datapreview as datapreview
+import ckan.lib.dictization.model_dictize as model_dictize
+import ckan.model as model
 import ckan.plugins.toolkit as toolkit
+import ckanext.spc.images as spc_images
 
 logger = logging.getLogger(__name__)
-cache = CacheManager()
 
 
 def get_helpers():
@@ -38,6 +40,8 @@ def get_helpers():
         spc_get_max_image_size=get_max_image_size,
         spc_get_package_name_by_id=get_package_name_by_id,
         spc_is_restricted=is_restricted,
+        spc_get_organization=get_organization,
+        spc_logo_variant_url=spc_images.logo_variant_url,
     )
 
 
@@ -53,8 +57,7 @@ def countries_list(countries):
 def spc_has_cesium_view(res):
     is_cesium = False
     if res.get('has_views'):
-        views = toolkit.get_action('resource_view_list')(
-            {'user': toolkit.c.user}, {'id': res['id']})
+        views = _package_resource_views(res['package_id']).get(res['id'], [])
         is_cesium = any(
             view['view_type'] == 'cesium_view'
             for view in views
@@ -62,6 +65,45 @@ def spc_has_cesium_view(res):
     return is_cesium
 
 
+def _package_resource_views(package_id):
+    """Views of all the resources of the package, grouped by resource id.
+
+    Views are fetched with a single query and memoized for the current
+    request, so helpers called for every resource don't hit DB again.
+    """
+    if not has_app_context():
+        return _load_package_resource_views(package_id)
+    cache = g.setdefault('spc_resource_views', {})
+    if package_id not in cache:
+        cache[package_id] = _load_package_resource_views(package_id)
+    return cache[package_id]
+
+
+def _load_package_resource_views(package_id):
+    try:
+        toolkit.check_access(
+            'package_show', {'user': toolkit.c.user}, {'id': package_id})
+    except (toolkit.NotAuthorized, toolkit.ObjectNotFound):
+        return {}
+
+    views = model.Session.query(model.ResourceView).join(
+        model.Resource, model.Resource.id == model.ResourceView.resource_id
+    ).filter(
+        model.Resource.package_id == package_id,
+        model.Resource.state == 'active'
+    ).order_by(model.ResourceView.order)
+    views = [
+        view for view in views
+        if datapreview.get_view_plugin(view.view_type)
+    ]
+
+    grouped = {}
+    context = {'model': model, 'session': model.Session}
+    for view in model_dictize.resource_view_list_dictize(views, context):
+        grouped.setdefault(view['resource_id'], []).append(view)
+    return grouped
+
+
 def spc_dataset_suggestion_form():
     return config.get('spc.dataset_suggestion.form', '/dataset-suggestions/add')
 
@@ -83,36 +125,12 @@ def get_max_image_size():
 
 
 def get_eez_options():
-
-    options = sorted([
-        value for value in {
-            feature['properties']['Territory1']: {
-                'text': feature['properties']['Territory1'],
-                'value': json.dumps(feature['geometry'])
-            }
-            for feature in eez
-        }.values()
-    ], key=lambda o: o['text'])
-
-    result = []
-    for option in options:
-        if len(option['value']) / 1024 > 31:
-            logger.warning((
-                '[{}] has too long coordinates definition '
-                'and will be excluded from predefined areas'
-            ).format(option['text']))
-            continue
-        result.append(option)
     # result.append({'text': 'All countries', 'value': 'all'})
-    return result
+    return list(eez.options)
 
 
 def get_extent_for_country(country):
-    spatial = F.first(F.filter(
-        F.compose(F.partial(eq, country), itemgetter('text')),
-        get_eez_options()
-    ))
-    return spatial
+    return eez.options_by_territory.get(country)
 
 
 def spc_get_footer():
@@ -122,30 +140,11 @@ def spc_get_footer():
         return get_html
 
 
-@cache.cache('footer_from_drupal', expire=3600)
 def _spc_get_footer_from_drupal(drupal_url=None):
     if drupal_url is None or drupal_url == h.full_current_url(
     ).split('?')[0][:-1]:
         return None
-    r = None
-    try:
-        r = requests.get(
-            drupal_url + '/footer_export', verify=False, timeout=10
-        )
-    except requests.exceptions.Timeout:
-        logger.warning(drupal_url + '/footer_export connection timeout')
-    except requests.exceptions.TooManyRedirects:
-        logger.warning(drupal_url + '/footer_export too many redirects')
-    except requests.exceptions.RequestException as e:
-        logger.error(e.message)
-
-    if r:
-        footer = r.json()
-    else:
-        return None
-
-    if footer and 'main' in footer:
-        return footer['main'][0]
+    return drupal_footer.get(drupal_url)
 
 
 def get_footer_css_url():
@@ -164,13 +163,11 @@ _is_cesium_view = F.compose(
 
 
 def spc_national_map_previews(pkg):
+    views = _package_resource_views(pkg['id'])
     return F.filter(F.first, [
         (F.first(F.filter(
             _is_cesium_view,
-            toolkit.get_action('resource_view_list')(
-                {'user': toolkit.c.user},
-                {'id': res['id']}
-            )
+            views.get(res['id'], [])
         )), res) for res in pkg['resources']
     ])
 
@@ -240,3 +237,12 @@ def is_restricted(package):
                 break
 
     return True if access == 'restricted' else False
+
+
+def get_organization(org):
+    """Cached alternative to `h.get_organization`.
+
+    Organization summary doesn't include datasets, users and number of
+    followers.
+    """
+    return org_cache.get(org) or {}
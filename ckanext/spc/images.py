@@ -0,0 +1,115 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+from PIL import Image
+
+from ckan.lib.uploader import get_storage_path
+
+logger = logging.getLogger(__name__)
+
+# Variant name and its max width. The first one replaces uploaded image,
+# the rest are stored next to it with `<name>-` prefix
+LOGO_VARIANTS = OrderedDict([
+    ('header', 350),
+    ('thumbnail', 200),
+])
+
+# processed images bigger than this(in bytes) are moved to disk
+_SPOOL_SIZE = 1024 * 1024
+_CHUNK_SIZE = 64 * 1024
+
+
+def content_hash(stream):
+    digest = hashlib.sha1()
+    for chunk in iter(lambda: stream.read(_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def logo_variants(stream, format, variants=LOGO_VARIANTS):
+    """Resize image from `stream` into every variant.
+
+    Image is decoded only once, at the smallest scale that is enough for
+    the widest variant. Results are cached by content hash, so the same
+    image is never processed twice.
+
+    Returns dict of variant names and binary files, ready for reading.
+    """
+    cache_dir = _cache_dir(content_hash(stream))
+    paths = {
+        name: os.path.join(cache_dir, '{}.{}'.format(name, format.lower()))
+        for name in variants
+    } if cache_dir else {}
+    if paths and all(os.path.exists(path) for path in paths.values()):
+        return OrderedDict(
+            (name, _spool(open(paths[name], 'rb'))) for name in variants
+        )
+
+    img = Image.open(stream)
+    widest = max(variants.values())
+    if img.width > widest:
+        # JPEG is decoded at reduced scale. Other formats ignore it
+        img.draft(img.mode, (widest, img.height * widest // img.width))
+
+    result = OrderedDict()
+    for name, width in sorted(
+            variants.items(), key=lambda item: item[1], reverse=True):
+        img.thumbnail((width, img.height), Image.LANCZOS)
+        output = tempfile.SpooledTemporaryFile(_SPOOL_SIZE)
+        img.save(output, format=format, optimize=True, subsampling=0)
+        output.seek(0)
+        if paths:
+            _store(output, paths[name])
+        result[name] = output
+
+    return OrderedDict((name, result[name]) for name in variants)
+
+
+def logo_variant_url(url, variant):
+    """URL of the `variant` of uploaded logo or original `url`, when there
+    is no such variant.
+    """
+    storage_path = get_storage_path()
+    if not url or not storage_path or '/uploads/' not in url:
+        return url
+    folder, _, filename = url.split('/uploads/', 1)[1].rpartition('/')
+    name = '{}-{}'.format(variant, filename)
+    if not os.path.exists(
+            os.path.join(storage_path, 'storage', 'uploads', folder, name)):
+        return url
+    return url[:-len(filename)] + name
+
+
+def _cache_dir(digest):
+    storage_path = get_storage_path()
+    if not storage_path:
+        return None
+    return os.path.join(
+        storage_path, 'storage', 'uploads', 'spc_logos', digest[:2], digest
+    )
+
+
+def _spool(file):
+    with file:
+        output = tempfile.SpooledTemporaryFile(_SPOOL_SIZE)
+        shutil.copyfileobj(file, output)
+    output.seek(0)
+    return output
+
+
+def _store(file, path):
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(path), delete=False) as output:
+            shutil.copyfileobj(file, output)
+        os.rename(output.name, path)
+    except (IOError, OSError) as e:
+        logger.warning('Cannot cache logo variant %s: %s', path, e)
+    file.seek(0)
@@ -1,21 +1,39 @@
 import csv
 import logging
-import sys
+from collections import OrderedDict
+from datetime import datetime, timedelta
 
 import ckan.lib.helpers as h
 
 import ckan.model as model
-import requests
-import requests.exceptions as exc
+import ckan.lib.search as search
+import ckan.plugins.toolkit as tk
 from ckan.common import config
+from ckan.lib.redis import connect_to_redis
 from ckan.lib.mailer import mail_user
+
+import ckanext.spc.utils as spc_utils
+from ckanext.spc.link_checker import LinkChecker
+from ckanext.spc.model import FiveStarRating, LinkHealth
+
 logger = logging.getLogger(__name__)
 
+# Redis key, that marks enqueued rating job of the package. It expires
+# eventually, so lost jobs don't block rating updates forever
+FIVE_STAR_RATING_PENDING = 'spc:five_star_rating:pending:{}'
+FIVE_STAR_RATING_PENDING_TTL = 3600
+
 
 def broken_links_report(recepients=[]):
-    broken_count = 0
+    """Check links of resources and write the report.
+
+    Only links that were not checked during `spc.broken_links.max_age`
+    seconds or whose resources were changed since the last check are
+    requested. The rest is taken from `spc_link_health` table.
+    """
     resources = model.Session.query(
-        model.Resource
+        model.Resource.id, model.Resource.package_id, model.Resource.url,
+        model.Resource.metadata_modified
     ).join(model.Package,
            model.Package.id == model.Resource.package_id).outerjoin(
                model.PackageExtra,
@@ -24,44 +42,59 @@ def broken_links_report(recepients=[]):
            ).filter(
                model.Resource.state == 'active',
                model.PackageExtra.key.is_(None)
-           )
-    total = resources.count()
-    file = open(config['spc.report.broken_links_filepath'], 'wb')
-    report = csv.writer(file)
-    report.writerow(['Page', 'Broken URL', 'HTTP Code', 'Reason'])
-    for i, res in enumerate(resources, 1):
-        logger.debug(
-            'Processing %s of %s. Broken links: %s', i, total, broken_count
-        )
+           ).all()
+    health = {item.resource_id: item for item in model.Session.query(
+        LinkHealth
+    )}
+    since = datetime.utcnow() - timedelta(seconds=tk.asint(
+        config.get('spc.broken_links.max_age', 7 * 24 * 3600)
+    ))
+    stale = [
+        res for res in resources if res.id not in health
+        or not health[res.id].is_fresh(res.url, res.metadata_modified, since)
+    ]
+    logger.debug('Checking %s of %s resources', len(stale), len(resources))
 
-        sys.stdout.flush()
-        try:
-            resp = requests.head(res.url, timeout=5)
-            if resp.ok:
-                continue
-            code, reason = resp.status_code, resp.reason
-            # it's likely incorrect request to service endpoint
-            if 400 == code:
-                continue
-        except (exc.ConnectTimeout, exc.ReadTimeout):
-            code, reason = 504, 'Request timeout'
-        except exc.ConnectionError:
-            code, reason = 520, 'Connection Error'
-        except (exc.MissingSchema, exc.InvalidSchema):
-            continue
-        except exc.InvalidURL:
-            code, reason = 520, 'Invalid URL'
+    checker = LinkChecker(
+        workers=tk.asint(config.get('spc.broken_links.workers', 16)),
+        per_host=tk.asint(config.get('spc.broken_links.per_host', 2)),
+        max_host_failures=tk.asint(
+            config.get('spc.broken_links.max_host_failures', 5)
+        )
+    )
+    results = checker.check_many([res.url for res in stale], {
+        res.url: (health[res.id].etag, health[res.id].last_modified)
+        for res in stale
+        if res.id in health and health[res.id].url == res.url
+    })
 
-        page = h.url_for(
-            'resource.read',
-            id=res.package_id,
-            resource_id=res.id,
-            qualified=True
+    checked_at = datetime.utcnow()
+    for res in stale:
+        item = health.get(res.id) or LinkHealth(resource_id=res.id)
+        if item.url != res.url:
+            item.etag = item.last_modified = None
+        item.etag, item.last_modified = checker.validators.get(
+            res.url, (item.etag, item.last_modified)
         )
+        item.code, item.reason = results[res.url] or (None, None)
+        item.url, item.checked_at = res.url, checked_at
+        model.Session.add(item)
+
+    # harvested, deleted, etc. resources are not checked anymore
+    checked = {res.id for res in resources}
+    for resource_id, item in health.items():
+        if resource_id not in checked:
+            model.Session.delete(item)
+    model.Session.commit()
+
+    with open(
+            config['spc.report.broken_links_filepath'], 'w', newline=''
+    ) as file:
+        broken_count = write_broken_links_report(file)
+    logger.info(
+        'Broken links: %s of %s resources', broken_count, len(resources)
+    )
 
-        report.writerow([page, res.url.encode('utf-8'), code, reason])
-        broken_count += 1
-    file.close()
     users = model.Session.query(
         model.User
     ).filter(model.User.name.in_(recepients), ~model.User.email.is_(None))
@@ -69,3 +102,83 @@ def broken_links_report(recepients=[]):
     message = u'There is new report available at {}'.format(url)
     for user in users:
         mail_user(user, 'Broken links report', message)
+
+
+def write_broken_links_report(file):
+    """Write CSV report of links, that were broken during the last check.
+    """
+    report = csv.writer(file)
+    report.writerow(['Page', 'Broken URL', 'HTTP Code', 'Reason'])
+    broken_count = 0
+    for item, package_id in LinkHealth.broken():
+        page = h.url_for(
+            'resource.read',
+            id=package_id,
+            resource_id=item.resource_id,
+            qualified=True
+        )
+        report.writerow([page, item.url, item.code, item.reason])
+        broken_count += 1
+    return broken_count
+
+
+def update_ga_view_counts(batch_size=500):
+    """Reindex packages with outdated `ga_view_count` in search index.
+
+    Only packages whose GA views changed since last indexation are
+    reindexed, so it's cheap enough to be called after every GA import.
+    """
+    packages = model.Session.query(
+        model.Package.id, model.Package.name
+    ).filter(model.Package.state == 'active').order_by(model.Package.id)
+    total = updated = 0
+    last_id = None
+    while True:
+        # keyset instead of offset, so batches are stable even if
+        # packages are added or removed while the job is running
+        query = packages
+        if last_id is not None:
+            query = query.filter(model.Package.id > last_id)
+        batch = OrderedDict(query.limit(batch_size))
+        if not batch:
+            break
+        last_id = next(reversed(batch))
+        total += len(batch)
+
+        counts = spc_utils.ga_view_counts(list(batch.values()))
+        indexed = {
+            doc['id']: doc.get('ga_view_count') or 0
+            for doc in spc_utils.search_by_ids(list(batch), 'ga_view_count')
+        }
+        for id, name in batch.items():
+            if id not in indexed or indexed[id] == counts[name]:
+                continue
+            logger.debug('Updating GA views of <%s>', name)
+            search.rebuild(id, defer_commit=True)
+            updated += 1
+    search.commit()
+    logger.info('GA views updated for %s of %s packages', updated, total)
+    return updated
+
+
+def refresh_drupal_footer(drupal_url):
+    if spc_utils.drupal_footer.refresh(drupal_url) is None:
+        logger.warning('Drupal footer was not refreshed, keeping the old one')
+
+
+def update_five_star_rating(package_id):
+    """Count stars of the package and reindex it, if rating was changed.
+    """
+    # changes made from now on need another job
+    connect_to_redis().delete(FIVE_STAR_RATING_PENDING.format(package_id))
+    try:
+        pkg_dict = tk.get_action('package_show')(
+            {'ignore_auth': True, 'use_cache': False}, {'id': package_id}
+        )
+    except tk.ObjectNotFound:
+        return None
+    rating = spc_utils.count_stars(pkg_dict)
+    if FiveStarRating.get(package_id) != rating:
+        FiveStarRating.set(package_id, rating)
+        search.rebuild(package_id)
+    return rating
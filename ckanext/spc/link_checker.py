@@ -0,0 +1,130 @@
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import requests.adapters
+import requests.exceptions as exc
+from six.moves.urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# Some servers reject HEAD, but serve GET
+_HEAD_REJECTED = (403, 405, 501)
+
+
+class LinkChecker(object):
+    """Concurrent checker of external links.
+
+    At most `per_host` requests are sent to the same host at once. After
+    `max_host_failures` connection failures in a row, remaining links of
+    the host are reported as broken without requests.
+
+    Result of the check is None for working links(and links that cannot
+    be checked) or `(code, reason)` tuple for broken ones. ETag and
+    Last-Modified of every response are collected into `validators`.
+    """
+
+    def __init__(self, workers=16, per_host=2, timeout=5,
+                 max_host_failures=5):
+        self.workers = workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self.max_host_failures = max_host_failures
+
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=workers, pool_maxsize=workers
+        )
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lock = threading.Lock()
+        self._host_slots = defaultdict(
+            lambda: threading.BoundedSemaphore(self.per_host)
+        )
+        self._host_failures = defaultdict(int)
+        self._open_circuits = {}
+        self.validators = {}
+
+    def check_many(self, urls, validators=None):
+        """Check every unique URL from `urls`.
+
+        `validators` maps URLs to `(etag, last_modified)` of previous
+        responses, so unchanged links are confirmed with conditional
+        requests.
+
+        Returns dict of URLs and results of the check.
+        """
+        validators = validators or {}
+        urls = list(set(urls))
+        with ThreadPoolExecutor(max(1, min(self.workers, len(urls)))) as ex:
+            return dict(zip(urls, ex.map(
+                lambda url: self.check(url, validators.get(url)), urls
+            )))
+
+    def check(self, url, validators=None):
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            slot = self._host_slots[host]
+        with slot:
+            if host in self._open_circuits:
+                return self._open_circuits[host]
+            result, failed = self._probe(
+                url, _conditional_headers(validators)
+            )
+
+        with self._lock:
+            if not failed:
+                self._host_failures[host] = 0
+            else:
+                self._host_failures[host] += 1
+                if self._host_failures[host] >= self.max_host_failures:
+                    if host not in self._open_circuits:
+                        logger.warning(
+                            'Too many failures from %s, skipping it', host
+                        )
+                    self._open_circuits[host] = result
+        return result
+
+    def _probe(self, url, headers):
+        """Check the link and report whether the host failed to respond.
+        """
+        try:
+            resp = self.session.head(
+                url, timeout=self.timeout, headers=headers
+            )
+            if resp.status_code in _HEAD_REJECTED:
+                resp = self.session.get(
+                    url, timeout=self.timeout, headers=headers, stream=True
+                )
+                resp.close()
+        except (exc.ConnectTimeout, exc.ReadTimeout):
+            return (504, 'Request timeout'), True
+        except exc.ConnectionError:
+            return (520, 'Connection Error'), True
+        except (exc.MissingSchema, exc.InvalidSchema):
+            return None, False
+        except exc.InvalidURL:
+            return (520, 'Invalid URL'), False
+        except exc.RequestException as e:
+            return (520, type(e).__name__), False
+
+        self.validators[url] = (
+            resp.headers.get('ETag'), resp.headers.get('Last-Modified')
+        )
+        # 400 is likely incorrect request to service endpoint
+        if resp.ok or resp.status_code == 400:
+            return None, False
+        return (resp.status_code, resp.reason), False
+
+
+def _conditional_headers(validators):
+    etag, last_modified = validators or (None, None)
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
@@ -1,4 +1,6 @@
-import math
+import json
+
+from six import string_types
 
 import ckan.plugins.toolkit as tk
 import ckan.lib.helpers as h
@@ -70,7 +72,10 @@ def five_star_rating(context, data_dict):
         return {'rating': 0}
 
     # At leas one link must be available
-    resources = [res for res in resources if utils.check_link(res['url'])]
+    available = utils.link_probe.check_many(
+        [res['url'] for res in resources]
+    )
+    resources = [res for res in resources if available[res['url']]]
     if not resources and not utils.check_link(url):
         return {'rating': 0}
     for i in (4, 3, 2):
@@ -100,41 +105,121 @@ five_star_rating.__doc__ = five_star_rating.__doc__.format(
 
 @tk.side_effect_free
 def spc_package_search(context, data_dict):
-    default_limit_rows = 1000
-    revice_all_data = False
-
-    if 'rows' not in data_dict:
-        data_dict['rows'] = default_limit_rows
-        revice_all_data = True
-
-    types_count = {}
-
-    def _countTypes(item):
-        if item['type'] not in types_count:
-            types_count[item['type']] = 1
-        else:
-            types_count[item['type']] += 1
-        return True
-
-    results = tk.get_action('package_search')(context, data_dict)
-
-    if revice_all_data and results and results['count'] > 1000:
-        extra_requests_number = int(math.ceil(
-            results['count'] / 1000.0)) - 1
-        for i in range(1, extra_requests_number + 1):
-            offset = i * 1000
-            data_dict['start'] = offset
-            extra_request = tk.get_action('package_search')(
-                context, data_dict)
-            if extra_request and extra_request['results']:
-                results['results'] += extra_request['results']
-
-    map(_countTypes, results['results'])
-    results['types_count'] = types_count
+    """Same as `package_search`, but returns all the matches if `rows` is
+    not specified. In addition, result contains `types_count` - number of
+    matched datasets of every type.
 
+    Without `sort`, `start` and `ext_popular_first`, all the matches are
+    fetched by id, which keeps deep pages cheap. Otherwise they are
+    fetched with growing offsets, so the requested order is kept.
+    """
+    if 'rows' in data_dict:
+        results = tk.get_action('package_search')(
+            context.copy(), _with_type_facet(data_dict)
+        )
+        results['types_count'] = _types_count(context, data_dict, results)
+        return results
+
+    if _is_ordered(data_dict):
+        pages = _iter_package_search_by_offset(context, data_dict)
+    else:
+        pages = iter_package_search(context, data_dict)
+    results = next(pages)
+    for page in pages:
+        results['results'] += page['results']
     return results
 
 
+def iter_package_search(context, data_dict, batch_size=1000):
+    """Yield consecutive pages of `package_search` results.
+
+    Instead of growing `start` offsets, every page continues right after
+    the last id of the previous page(results are sorted by id), so each
+    SOLR request costs the same no matter how deep it is. Only the first
+    page is faceted and contains `types_count`.
+    """
+    if _is_ordered(data_dict):
+        raise tk.ValidationError({
+            key: [tk._('Results are always sorted by id')]
+            for key in ('sort', 'start', 'ext_popular_first')
+            if key in data_dict
+        })
+
+    data_dict = dict(data_dict, rows=batch_size, sort='id asc')
+    fq_list = list(data_dict.get('fq_list', []))
+    data_dict['fq_list'] = list(fq_list)
+
+    results = tk.get_action('package_search')(
+        context.copy(), _with_type_facet(data_dict)
+    )
+    results['types_count'] = _types_count(context, data_dict, results)
+    data_dict['facet'] = 'false'
+    while True:
+        yield results
+        if len(results['results']) < batch_size:
+            break
+        # cursor is unique for every page, so it's kept out of filterCache
+        data_dict['fq_list'] = fq_list + [
+            '{{!cache=false}}id:{{"{}" TO *]'.format(
+                results['results'][-1]['id']
+            )
+        ]
+        results = tk.get_action('package_search')(context.copy(), data_dict)
+
+
+def _iter_package_search_by_offset(context, data_dict, batch_size=1000):
+    """Yield consecutive pages of `package_search` results in the order
+    requested by caller, starting from caller's `start`.
+    """
+    start = tk.asint(data_dict.get('start', 0))
+    data_dict = dict(data_dict, rows=batch_size, start=start)
+
+    results = tk.get_action('package_search')(
+        context.copy(), _with_type_facet(data_dict)
+    )
+    results['types_count'] = _types_count(context, data_dict, results)
+    total = results['count']
+    data_dict['facet'] = 'false'
+    while True:
+        yield results
+        data_dict['start'] += batch_size
+        if len(results['results']) < batch_size \
+                or data_dict['start'] >= total:
+            break
+        results = tk.get_action('package_search')(context.copy(), data_dict)
+
+
+def _is_ordered(data_dict):
+    return 'sort' in data_dict or 'start' in data_dict or tk.asbool(
+        data_dict.get('ext_popular_first', False)
+    )
+
+
+def _with_type_facet(data_dict):
+    fields = data_dict.get('facet.field') or []
+    if isinstance(fields, string_types):
+        fields = json.loads(fields)
+    return dict(data_dict, **{
+        'facet.field': json.dumps(list(set(fields) | {'type'}))
+    })
+
+
+def _types_count(context, data_dict, results):
+    if 'facet.limit' not in data_dict:
+        # default limit is way above the number of dataset types
+        return dict(results.get('facets', {}).get('type', {}))
+
+    # Limit requested by caller may hide some types and package_search
+    # rejects per-field limits, so types are counted separately
+    counts = tk.get_action('package_search')(context.copy(), dict(
+        data_dict, rows=0, start=0, facet='true', **{
+            'facet.field': json.dumps(['type']),
+            'facet.limit': -1,
+        }
+    ))
+    return dict(counts.get('facets', {}).get('type', {}))
+
+
 @tk.side_effect_free
 def get_access_requests_for_pkg(context, data_dict):
     """
@@ -186,6 +271,17 @@ def get_access_request(context, data_dict):
 
 @tk.side_effect_free
 def spc_download_tracking_list(context, data_dict):
+    """Downloads of the package resources, starting from the latest one.
+
+    :param id: id or name of the package
+    :param limit: number of records(default: 20)
+    :param after: `next` value from the previous page
+    :param offset: number of records to skip, if `after` is not
+        specified. Prefer `after`, as it's fast even on the last pages.
+
+    Result contains `count` of all downloads and `next` - value for the
+    `after` parameter, if there are more records.
+    """
     id = tk.get_or_bust(data_dict, 'id')
     pkg = model.Package.get(id)
     _check_access('spc_download_tracking_list', context, {
@@ -193,11 +289,19 @@ def spc_download_tracking_list(context, data_dict):
         'owner_org': pkg.owner_org
     })
     limit = tk.asint(data_dict.get('limit', 20))
-    offset = tk.asint(data_dict.get('offset', 0))
-    query = DownloadTracking.query(id=pkg.id)
-
-    total = query.count()
-    query = query.offset(offset).limit(limit)
+    after = _parse_download_cursor(data_dict.get('after'))
+    query = DownloadTracking.query(id=pkg.id, after=after)
+    if after is None:
+        query = query.offset(tk.asint(data_dict.get('offset', 0)))
+    rows = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        track = rows[-1][0]
+        next_cursor = '{}|{}'.format(
+            track.downloaded_at.isoformat(), track.id
+        )
 
     results = [
         {
@@ -207,9 +311,20 @@ def spc_download_tracking_list(context, data_dict):
             'resource_name': resource.name,
             'downloaded_at': track.downloaded_at.isoformat()
         }
-        for (track, resource, user) in query
+        for (track, resource, user) in rows
     ]
     return {
         'results': results,
-        'count': total
+        'count': DownloadTracking.total(pkg.id),
+        'next': next_cursor
     }
+
+
+def _parse_download_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        downloaded_at, id = cursor.rsplit('|', 1)
+        return h.date_str_to_datetime(downloaded_at), int(id)
+    except (TypeError, ValueError):
+        raise tk.ValidationError({'after': ['Invalid value']})
@@ -0,0 +1,25 @@
+"""Add fingerprint to spc_drupal_user
+
+Revision ID: 3f9d2c7b8a41
+Revises: 66b79e5df480
+Create Date: 2026-10-17 12:40:05.118342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '3f9d2c7b8a41'
+down_revision = '66b79e5df480'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'spc_drupal_user', sa.Column('fingerprint', sa.String)
+    )
+
+
+def downgrade():
+    op.drop_column('spc_drupal_user', 'fingerprint')
@@ -0,0 +1,40 @@
+"""Create spc_search_query_rollups table
+
+Revision ID: 66b79e5df480
+Revises: da84a1664b84
+Create Date: 2026-10-17 10:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '66b79e5df480'
+down_revision = 'da84a1664b84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'spc_search_query_rollups',
+        sa.Column('period', sa.UnicodeText, primary_key=True),
+        sa.Column('period_start', sa.Date, primary_key=True),
+        sa.Column('query', sa.UnicodeText, primary_key=True),
+        sa.Column('count', sa.Integer, server_default='0')
+    )
+    op.create_index(
+        'idx_spc_search_query_rollups_top',
+        'spc_search_query_rollups',
+        ['period', 'period_start', sa.text('count DESC'), 'query']
+    )
+    op.create_index(
+        'idx_spc_search_queries_count',
+        'spc_search_queries',
+        [sa.text('count DESC'), 'query']
+    )
+
+
+def downgrade():
+    op.drop_index('idx_spc_search_queries_count', 'spc_search_queries')
+    op.drop_table('spc_search_query_rollups')
@@ -0,0 +1,32 @@
+"""Create spc_five_star_rating table
+
+Revision ID: 8c1e5a0f7d23
+Revises: 3f9d2c7b8a41
+Create Date: 2026-10-18 09:21:47.530914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '8c1e5a0f7d23'
+down_revision = '3f9d2c7b8a41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'spc_five_star_rating',
+        sa.Column(
+            'package_id', sa.String,
+            sa.ForeignKey('package.id', ondelete='CASCADE'),
+            primary_key=True
+        ),
+        sa.Column('rating', sa.Integer, nullable=False),
+        sa.Column('updated_at', sa.DateTime)
+    )
+
+
+def downgrade():
+    op.drop_table('spc_five_star_rating')
@@ -0,0 +1,36 @@
+"""Create spc_link_health table
+
+Revision ID: b47e2d9c0a15
+Revises: 8c1e5a0f7d23
+Create Date: 2026-10-18 11:05:12.904418
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b47e2d9c0a15'
+down_revision = '8c1e5a0f7d23'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'spc_link_health',
+        sa.Column(
+            'resource_id', sa.String,
+            sa.ForeignKey('resource.id', ondelete='CASCADE'),
+            primary_key=True
+        ),
+        sa.Column('url', sa.String),
+        sa.Column('code', sa.Integer),
+        sa.Column('reason', sa.String),
+        sa.Column('etag', sa.String),
+        sa.Column('last_modified', sa.String),
+        sa.Column('checked_at', sa.DateTime)
+    )
+
+
+def downgrade():
+    op.drop_table('spc_link_health')
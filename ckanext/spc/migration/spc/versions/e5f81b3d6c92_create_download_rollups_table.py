@@ -0,0 +1,58 @@
+"""Create spc_download_rollups table
+
+Revision ID: e5f81b3d6c92
+Revises: b47e2d9c0a15
+Create Date: 2026-10-18 13:48:26.771205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e5f81b3d6c92'
+down_revision = 'b47e2d9c0a15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'spc_download_rollups',
+        sa.Column('day', sa.Date, primary_key=True),
+        sa.Column(
+            'resource_id', sa.String,
+            sa.ForeignKey('resource.id', ondelete='CASCADE'),
+            primary_key=True
+        ),
+        sa.Column(
+            'user_id', sa.String,
+            sa.ForeignKey('user.id', ondelete='CASCADE'),
+            primary_key=True
+        ),
+        sa.Column('count', sa.Integer, server_default='0')
+    )
+    op.create_index(
+        'idx_spc_download_rollups_resource',
+        'spc_download_rollups',
+        ['resource_id', 'day']
+    )
+    op.create_index(
+        'idx_spc_download_tracking_resource_downloaded',
+        'spc_download_tracking',
+        ['resource_id', 'downloaded_at', 'id']
+    )
+    op.execute(
+        'INSERT INTO spc_download_rollups (day, resource_id, user_id, count) '
+        'SELECT downloaded_at::date, resource_id, user_id, count(*) '
+        'FROM spc_download_tracking '
+        'WHERE resource_id IS NOT NULL AND user_id IS NOT NULL '
+        'GROUP BY 1, 2, 3'
+    )
+
+
+def downgrade():
+    op.drop_index(
+        'idx_spc_download_tracking_resource_downloaded',
+        'spc_download_tracking'
+    )
+    op.drop_table('spc_download_rollups')
@@ -1,7 +1,9 @@
 from ckanext.spc.model.base import Base
-from ckanext.spc.model.search_query import SearchQuery
+from ckanext.spc.model.search_query import SearchQuery, SearchQueryRollup
 from ckanext.spc.model.drupal_user import DrupalUser
 from ckanext.spc.model.access_request import AccessRequest
-from ckanext.spc.model.download_tracking import DownloadTracking
+from ckanext.spc.model.download_tracking import DownloadTracking, DownloadRollup
+from ckanext.spc.model.five_star_rating import FiveStarRating
+from ckanext.spc.model.link_health import LinkHealth
 
-__all__ = ['Base', 'SearchQuery', 'DrupalUser', 'AccessRequest', 'DownloadTracking']
+__all__ = ['Base', 'SearchQuery', 'SearchQueryRollup', 'DrupalUser', 'AccessRequest', 'DownloadTracking', 'DownloadRollup', 'FiveStarRating', 'LinkHealth']
@@ -1,6 +1,9 @@
 from datetime import datetime
 
-from sqlalchemy import Column, String, DateTime, Integer, ForeignKey, func
+from sqlalchemy import (
+    Column, String, DateTime, Date, Integer, ForeignKey, Index, func, or_
+)
+from sqlalchemy.dialects.postgresql import insert
 
 from sqlalchemy.orm import relationship
 
@@ -22,19 +25,12 @@ class DownloadTracking(Base):
     resource = relationship(model.Resource, lazy="subquery")
 
     @classmethod
-    def download(cls, user_name_or_id, resource_id):
-        obj = cls()
-        obj.user_id = model.User.get(user_name_or_id).id
-        obj.resource_id = resource_id
-        return obj
+    def query(cls, id=None, date_range=None, user=None, after=None):
+        """Downloads, starting from the latest one.
 
-    def save(self):
-        model.Session.add(self)
-        model.Session.commit()
-        return self
-
-    @classmethod
-    def query(cls, id=None, date_range=None, user=None):
+        `after` is a pair of `downloaded_at` and `id` from the last row of
+        the previous page.
+        """
         query = (
             model.Session.query(DownloadTracking, model.Resource, model.User)
             .join(
@@ -42,7 +38,15 @@ class DownloadTracking(Base):
                 model.Resource.id == DownloadTracking.resource_id,
             )
             .join(model.User, model.User.id == DownloadTracking.user_id)
-        ).order_by(DownloadTracking.downloaded_at.desc())
+        ).order_by(
+            DownloadTracking.downloaded_at.desc(), DownloadTracking.id.desc()
+        )
+        if after:
+            downloaded_at, id_ = after
+            query = query.filter(or_(
+                cls.downloaded_at < downloaded_at,
+                (cls.downloaded_at == downloaded_at) & (cls.id < id_)
+            ))
         if id:
             query = query.filter(model.Resource.package_id==id)
         if date_range:
@@ -51,18 +55,46 @@ class DownloadTracking(Base):
             query = query.filter(cls.user_id == model.User.get(user).id)
         return query
 
+    @classmethod
+    def export_query(cls, package_id=None, org_id=None, date_range=None):
+        """Plain rows of downloads for reports, starting from the latest.
+        """
+        query = model.Session.query(
+            cls.downloaded_at,
+            model.User.name.label('user'),
+            model.Resource.package_id,
+            cls.resource_id,
+            model.Resource.name.label('resource_name'),
+        ).join(
+            model.Resource, model.Resource.id == cls.resource_id
+        ).join(
+            model.User, model.User.id == cls.user_id
+        ).order_by(cls.downloaded_at.desc(), cls.id.desc())
+        if package_id:
+            query = query.filter(model.Resource.package_id == package_id)
+        if org_id:
+            query = query.join(
+                model.Package, model.Package.id == model.Resource.package_id
+            ).filter(model.Package.owner_org == org_id)
+        if date_range:
+            query = query.filter(cls.downloaded_at.between(*date_range))
+        return query
+
     @classmethod
     def aggregated_query(cls, date_range=None, user=None):
+        rollup = DownloadRollup
         downloads = model.Session.query(
-            cls.resource_id, func.count(cls.user_id).label("total_downloads")
-        ).group_by(cls.resource_id)
+            rollup.resource_id,
+            func.sum(rollup.count).label("total_downloads")
+        ).group_by(rollup.resource_id)
         if date_range:
+            start, end = date_range
             downloads = downloads.filter(
-                cls.downloaded_at.between(*date_range)
+                rollup.day.between(_as_date(start), _as_date(end))
             )
         if user:
             downloads = downloads.filter(
-                cls.user_id == model.User.get(user).id
+                rollup.user_id == model.User.get(user).id
             )
 
         downloads = downloads.subquery()
@@ -70,3 +102,74 @@ class DownloadTracking(Base):
             model.Resource, downloads.c.total_downloads
         ).join(downloads, model.Resource.id == downloads.c.resource_id)
         return query
+
+    @classmethod
+    def total(cls, package_id):
+        """Number of downloads of package's resources.
+        """
+        return model.Session.query(
+            func.coalesce(func.sum(DownloadRollup.count), 0)
+        ).join(
+            model.Resource, model.Resource.id == DownloadRollup.resource_id
+        ).filter(model.Resource.package_id == package_id).scalar()
+
+
+class DownloadRollup(Base):
+    """Number of downloads per resource and user within a day.
+
+    Maintained together with `DownloadTracking`, so reports don't need to
+    aggregate raw downloads.
+    """
+    __tablename__ = "spc_download_rollups"
+
+    day = Column(Date, primary_key=True)
+    resource_id = Column(
+        String, ForeignKey(model.Resource.id), primary_key=True
+    )
+    user_id = Column(String, ForeignKey(model.User.id), primary_key=True)
+    count = Column(Integer, default=0)
+
+    @classmethod
+    def increment_many(cls, downloads, connection=None):
+        """Add `downloads`(dicts with `user_id`, `resource_id` and
+        `downloaded_at`) using single upsert statement.
+
+        Rows are ordered by primary key, so concurrent flushes cannot
+        deadlock.
+        """
+        counts = {}
+        for download in downloads:
+            key = (
+                download['downloaded_at'].date(),
+                download['resource_id'],
+                download['user_id'],
+            )
+            counts[key] = counts.get(key, 0) + 1
+        if not counts:
+            return
+        table = cls.__table__
+        stmt = insert(table).values([
+            {'day': day, 'resource_id': resource_id,
+             'user_id': user_id, 'count': count}
+            for (day, resource_id, user_id), count in sorted(counts.items())
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.day, table.c.resource_id, table.c.user_id],
+            set_={'count': table.c.count + stmt.excluded.count}
+        )
+        (connection or model.Session).execute(stmt)
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+Index(
+    'idx_spc_download_tracking_resource_downloaded',
+    DownloadTracking.resource_id, DownloadTracking.downloaded_at,
+    DownloadTracking.id
+)
+Index(
+    'idx_spc_download_rollups_resource',
+    DownloadRollup.resource_id, DownloadRollup.day
+)
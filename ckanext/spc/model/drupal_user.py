@@ -1,3 +1,7 @@
+import hashlib
+import json
+
+from six import ensure_binary
 from sqlalchemy import Column, String, Integer
 
 from ckanext.spc.model import Base
@@ -9,6 +13,12 @@ class DrupalUser(Base):
 
     ckan_user = Column(String, primary_key=True)
     drupal_user = Column(Integer)
+    # hash of Drupal details at the moment of the last synchronization
+    fingerprint = Column(String)
+
+    @staticmethod
+    def make_fingerprint(name, mail):
+        return hashlib.sha1(ensure_binary(json.dumps([name, mail]))).hexdigest()
 
     @classmethod
     def create_or_get_user(cls, ckan_user, drupal_user):
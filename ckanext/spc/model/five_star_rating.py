@@ -0,0 +1,41 @@
+from datetime import datetime
+
+from sqlalchemy import Column, String, DateTime, Integer, ForeignKey
+
+import ckan.model as model
+
+from ckanext.spc.model import Base
+
+
+class FiveStarRating(Base):
+    """Rating computed by the background job. Search index only reads it.
+    """
+    __tablename__ = "spc_five_star_rating"
+
+    package_id = Column(
+        String,
+        ForeignKey(model.Package.id, ondelete="CASCADE"),
+        primary_key=True
+    )
+    rating = Column(Integer, nullable=False)
+    updated_at = Column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+    @classmethod
+    def get(cls, package_id):
+        """Stored rating of the package or None, if it's not computed yet.
+        """
+        return model.Session.query(cls.rating).filter(
+            cls.package_id == package_id
+        ).scalar()
+
+    @classmethod
+    def set(cls, package_id, rating):
+        obj = model.Session.query(cls).get(package_id) or cls(
+            package_id=package_id
+        )
+        obj.rating = rating
+        model.Session.add(obj)
+        model.Session.commit()
+        return obj
@@ -0,0 +1,50 @@
+from datetime import datetime
+
+from sqlalchemy import Column, String, DateTime, Integer, ForeignKey, func
+
+import ckan.model as model
+
+from ckanext.spc.model import Base
+
+
+class LinkHealth(Base):
+    """Result of the last check of resource's URL.
+
+    `code` and `reason` are empty, unless the link is broken. `etag` and
+    `last_modified` come from the response and make the next check
+    conditional.
+    """
+    __tablename__ = "spc_link_health"
+
+    resource_id = Column(
+        String,
+        ForeignKey(model.Resource.id, ondelete="CASCADE"),
+        primary_key=True
+    )
+    url = Column(String)
+    code = Column(Integer)
+    reason = Column(String)
+    etag = Column(String)
+    last_modified = Column(String)
+    checked_at = Column(DateTime, default=datetime.utcnow)
+
+    def is_fresh(self, url, resource_modified, since):
+        """Whether check is still valid for the resource with `url`, that
+        was modified at `resource_modified`.
+        """
+        return (
+            self.url == url and self.checked_at >= since
+            and (not resource_modified or resource_modified <= self.checked_at)
+        )
+
+    @classmethod
+    def broken(cls):
+        return model.Session.query(cls, model.Resource.package_id).join(
+            model.Resource, model.Resource.id == cls.resource_id
+        ).filter(
+            model.Resource.state == 'active', cls.code.isnot(None)
+        ).order_by(model.Resource.package_id, model.Resource.position)
+
+    @classmethod
+    def last_check(cls):
+        return model.Session.query(func.max(cls.checked_at)).scalar()
@@ -1,4 +1,8 @@
-from sqlalchemy import Column, UnicodeText, Integer
+from datetime import date, timedelta
+from operator import itemgetter
+
+from sqlalchemy import Column, UnicodeText, Integer, Date, Index, or_
+from sqlalchemy.dialects.postgresql import insert
 
 from ckanext.spc.model import Base
 import ckan.model.meta as meta
@@ -20,3 +24,111 @@ class SearchQuery(Base):
 
         existing.count += 1
         return existing
+
+    @classmethod
+    def increment_many(cls, counts, connection=None):
+        """Add `counts`(mapping query -> number of searches) using single
+        upsert statement.
+
+        Rows are locked in the order of queries, so concurrent flushes
+        from different workers cannot deadlock.
+        """
+        if not counts:
+            return
+        stmt = insert(cls.__table__).values([
+            {'query': query, 'count': count}
+            for query, count in sorted(counts.items())
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.__table__.c.query],
+            set_={'count': cls.__table__.c.count + stmt.excluded.count}
+        )
+        (connection or meta.Session).execute(stmt)
+
+    @classmethod
+    def top(cls, limit, after=None):
+        """Most popular queries, starting right after `after`(pair of
+        count and query from the last row of the previous page).
+        """
+        query = meta.Session.query(cls)
+        return _paginate(query, cls, limit, after)
+
+
+class SearchQueryRollup(Base):
+    """Number of searches per query within a day or a week.
+    """
+    __tablename__ = 'spc_search_query_rollups'
+
+    periods = ('day', 'week')
+
+    period = Column(UnicodeText, primary_key=True)
+    period_start = Column(Date, primary_key=True)
+    query = Column(UnicodeText, primary_key=True)
+    count = Column(Integer, default=0)
+
+    @staticmethod
+    def period_start_for(period, day=None):
+        day = day or date.today()
+        if period == 'week':
+            return day - timedelta(days=day.weekday())
+        return day
+
+    @classmethod
+    def increment_many(cls, counts, connection=None, day=None):
+        """Add `counts` to the rollups of every period, that contains
+        `day`(today by default).
+
+        Rows are ordered by primary key, so concurrent flushes cannot
+        deadlock.
+        """
+        if not counts:
+            return
+        table = cls.__table__
+        stmt = insert(table).values(sorted([
+            {
+                'period': period,
+                'period_start': cls.period_start_for(period, day),
+                'query': query,
+                'count': count
+            }
+            for period in cls.periods
+            for query, count in counts.items()
+        ], key=itemgetter('period', 'period_start', 'query')))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.period, table.c.period_start, table.c.query],
+            set_={'count': table.c.count + stmt.excluded.count}
+        )
+        (connection or meta.Session).execute(stmt)
+
+    @classmethod
+    def top(cls, period, limit, after=None, period_start=None):
+        query = meta.Session.query(cls).filter(
+            cls.period == period,
+            cls.period_start == (
+                period_start or cls.period_start_for(period)
+            )
+        )
+        return _paginate(query, cls, limit, after)
+
+
+Index(
+    'idx_spc_search_queries_count',
+    SearchQuery.count.desc(), SearchQuery.query
+)
+Index(
+    'idx_spc_search_query_rollups_top',
+    SearchQueryRollup.period, SearchQueryRollup.period_start,
+    SearchQueryRollup.count.desc(), SearchQueryRollup.query
+)
+
+
+def _paginate(query, cls, limit, after):
+    """Keyset pagination over (count DESC, query ASC).
+    """
+    if after:
+        count, text = after
+        query = query.filter(or_(
+            cls.count < count,
+            (cls.count == count) & (cls.query > text)
+        ))
+    return query.order_by(cls.count.desc(), cls.query).limit(limit)
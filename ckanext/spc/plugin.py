@@ -5,10 +5,9 @@ import textract
 import uuid
 import hashlib
 import re
+import shutil
 import sqlalchemy as sa
 
-from io import StringIO
-from PIL import Image
 from collections import OrderedDict
 from six import string_types, ensure_binary
 
@@ -16,6 +15,8 @@ import ckan.model as model
 import ckan.plugins as plugins
 import ckan.plugins.toolkit as toolkit
 import ckan.lib.helpers as h
+import ckan.lib.jobs as jobs
+from ckan.lib.redis import connect_to_redis
 
 from ckan.lib.uploader import Upload as DefaultUpload
 from ckan.lib.uploader import ResourceUpload
@@ -26,6 +27,8 @@ from ckan.common import config
 from ckan.model.license import DefaultLicense, LicenseRegister, License
 
 import ckanext.spc.helpers as spc_helpers
+import ckanext.spc.images as spc_images
+import ckanext.spc.jobs as spc_jobs
 import ckanext.spc.utils as spc_utils
 import ckanext.spc.logic.action as spc_action
 import ckanext.spc.logic.auth as spc_auth
@@ -34,13 +37,13 @@ import ckanext.spc.validators as spc_validators
 from ckanext.spc.views import blueprints
 from ckanext.spc.cli import get_commnads
 from ckanext.spc.model.drupal_user import DrupalUser
+from ckanext.spc.model import FiveStarRating
 from ckanext.spc.ingesters import MendeleyBib
 
 import ckanext.scheming.helpers as scheming_helpers
 
 from ckanext.ingest.interfaces import IIngest
 from ckanext.discovery.plugins.search_suggestions.interfaces import ISearchTermPreprocessor
-from ckanext.harvest.model import HarvestObject, HarvestSource
 
 logger = logging.getLogger(__name__)
 
@@ -98,41 +101,82 @@ LicenseRegister._create_license_list = _redefine_create_license_list
 
 
 class Upload(DefaultUpload):
+    variants = {}
+
+    # only these formats are resized. The rest is stored as is
+    logo_formats = {'JPG': 'JPEG', 'JPEG': 'JPEG', 'PNG': 'PNG'}
+
+    def __init__(self, upload_to, old_filename=None):
+        super(Upload, self).__init__(upload_to, old_filename)
+        self.upload_to = upload_to
+
     def update_data_dict(self, data_dict, url_field, file_field, clear_field):
         '''
         Resize and optimize logo image before upload
         '''
-        uploaded_file = data_dict.get('logo_upload')
-
-        try:
-            img = Image.open(uploaded_file)
-        except (IOError, AttributeError):
-            super(Upload, self).update_data_dict(data_dict, url_field, file_field, clear_field)
-            return
+        uploaded_file = data_dict.get(file_field)
+        self.variants = {}
+
+        # Organization and group logos get all the variants. Site logo,
+        # uploaded through admin config, is only resized to fit the header
+        if self.upload_to == 'group':
+            wanted = spc_images.LOGO_VARIANTS
+        elif self.upload_to == 'admin':
+            wanted = OrderedDict(
+                list(spc_images.LOGO_VARIANTS.items())[:1]
+            )
+        else:
+            wanted = None
 
-        size = img.size
-        while True:
-            if size[0] < 350:
-                break
-            size = map(lambda x: int(x*0.75), size)
+        filename = getattr(uploaded_file, 'filename', None)
+        format = self.logo_formats.get(
+            (filename or '').rsplit('.', 1)[-1].upper()
+        )
+        if wanted and format:
+            try:
+                variants = spc_images.logo_variants(
+                    uploaded_file.stream, format, wanted
+                )
+            except Exception as e:
+                logger.warning('Cannot process uploaded image: %s', e)
+                uploaded_file.stream.seek(0)
+            else:
+                uploaded_file.stream = variants.pop(
+                    next(iter(spc_images.LOGO_VARIANTS))
+                )
+                self.variants = variants
 
-        img = img.resize(size, Image.LANCZOS)
-        file = StringIO()
+        super(Upload, self).update_data_dict(data_dict, url_field, file_field, clear_field)
 
-        format = uploaded_file.filename.split('.')[-1].upper()
-        format = 'JPEG' if format == 'JPG' else 'PNG'
+    def upload(self, max_size=2):
+        super(Upload, self).upload(max_size)
 
-        try:
-            img.save(file,
-                 format=format,
-                 optimize=True,
-                 subsampling=0)
-        except Exception:
-            super(Upload, self).update_data_dict(data_dict, url_field, file_field, clear_field)
+        # `clear` is set when old file is replaced or removed
+        old_filename = getattr(self, 'old_filename', None)
+        if getattr(self, 'clear', None) and old_filename \
+                and not old_filename.startswith('http'):
+            self._remove_variants(old_filename)
 
-        data_dict['logo_upload'].stream = file
+        if not getattr(self, 'filename', None):
+            return
+        for name, variant in self.variants.items():
+            path = os.path.join(
+                self.storage_path, '{}-{}'.format(name, self.filename)
+            )
+            with open(path, 'wb') as output:
+                shutil.copyfileobj(variant, output)
 
-        super(Upload, self).update_data_dict(data_dict, url_field, file_field, clear_field)
+    def _remove_variants(self, filename):
+        """Drop variants of the replaced or cleared logo.
+        """
+        for name in spc_images.LOGO_VARIANTS:
+            path = os.path.join(
+                self.storage_path, '{}-{}'.format(name, filename)
+            )
+            try:
+                os.remove(path)
+            except OSError:
+                pass
 
 class LocaleMiddleware(object):
     def __init__(self, app, config):
@@ -150,6 +194,19 @@ class LocaleMiddleware(object):
                 pass
         return self.app(environ, start_response)
 
+_drupal_engines = {}
+
+
+def _get_drupal_engine(url):
+    """Pooled engine for Drupal DB, shared by all requests.
+    """
+    if url not in _drupal_engines:
+        _drupal_engines[url] = sa.create_engine(
+            url, pool_pre_ping=True, pool_recycle=3600
+        )
+    return _drupal_engines[url]
+
+
 class SpcUserPlugin(plugins.SingletonPlugin):
     plugins.implements(plugins.IAuthenticator, inherit=True)
     plugins.implements(plugins.IConfigurer)
@@ -185,8 +242,10 @@ class SpcUserPlugin(plugins.SingletonPlugin):
         return name
 
     @staticmethod
-    def _save_drupal_user_id(ckan_user_id, drupal_user_id):
+    def _save_drupal_user_id(ckan_user_id, drupal_user_id, fingerprint=None):
         user = DrupalUser.create_or_get_user(ckan_user_id, drupal_user_id)
+        if fingerprint:
+            user.fingerprint = fingerprint
         model.Session.commit()
         return user
 
@@ -227,6 +286,18 @@ class SpcUserPlugin(plugins.SingletonPlugin):
             ckan_user=None,
             drupal_user=str(user_data.uid)
         )
+        fingerprint = DrupalUser.make_fingerprint(
+            user_data.name, user_data.mail
+        )
+
+        # nothing changed in Drupal since the last synchronization
+        if ckan_uid and ckan_uid.fingerprint == fingerprint:
+            name = model.Session.query(model.User.name).filter(
+                model.User.id == ckan_uid.ckan_user
+            ).scalar()
+            if name:
+                toolkit.c.user = name
+                return
 
         try:
             user_id = ckan_uid.ckan_user
@@ -235,10 +306,6 @@ class SpcUserPlugin(plugins.SingletonPlugin):
 
         user = self._get_user(user_id, user_data.mail)
 
-        # if we found user by email, we should "map" the ids
-        if user and not user_id:
-            self._save_drupal_user_id(user["id"], str(user_data.uid))
-
         if user:
             if user_data.mail != user['email']:
                 user['email'] = user_data.mail
@@ -263,8 +330,11 @@ class SpcUserPlugin(plugins.SingletonPlugin):
                                       {'ignore_auth': True,
                                       'user': ''},
                                       user)
-            # save drupal user ID
-            self._save_drupal_user_id(user["id"], str(user_data.uid))
+        # save drupal user ID. It also "maps" the ids, if we found user
+        # by email
+        self._save_drupal_user_id(
+            user["id"], str(user_data.uid), fingerprint
+        )
         toolkit.c.user = user['name']
 
     # IAuthenticator
@@ -278,8 +348,12 @@ class SpcUserPlugin(plugins.SingletonPlugin):
         drupal_sid = toolkit.request.cookies.get(self._drupal_session_name())
 
         if drupal_sid:
-            engine = sa.create_engine(self._connection)
-            user = engine.execute(
+            name = spc_utils.drupal_sessions.get(drupal_sid)
+            if name:
+                toolkit.c.user = name
+                return
+
+            user = _get_drupal_engine(self._connection).execute(
                 'SELECT u.name, u.mail, u.uid '
                 'FROM users u '
                 'JOIN sessions s on s.uid=u.uid '
@@ -292,9 +366,17 @@ class SpcUserPlugin(plugins.SingletonPlugin):
             try:
                 if user_data.name and user_data.name != '':
                     self._login_user(user_data)
+                    spc_utils.drupal_sessions.set(
+                        drupal_sid, toolkit.c.user
+                    )
             except AttributeError:
                 pass
 
+    def logout(self):
+        drupal_sid = toolkit.request.cookies.get(self._drupal_session_name())
+        if drupal_sid:
+            spc_utils.drupal_sessions.invalidate(drupal_sid)
+
     # IConfigurer
 
     def update_config(self, config_):
@@ -303,6 +385,7 @@ class SpcUserPlugin(plugins.SingletonPlugin):
 
         if not self._connection:
             raise Exception('Drupal7 extension has not been configured')
+        _get_drupal_engine(self._connection)
 
 class SpcPlugin(plugins.SingletonPlugin, DefaultTranslation):
     plugins.implements(plugins.IConfigurer)
@@ -321,6 +404,7 @@ class SpcPlugin(plugins.SingletonPlugin, DefaultTranslation):
     plugins.implements(plugins.IUploader, inherit=True)
     plugins.implements(plugins.IClick)
     plugins.implements(plugins.IResourceController, inherit=True)
+    plugins.implements(plugins.IOrganizationController, inherit=True)
 
     # IUploader
     def get_uploader(self, upload_to, old_filename):
@@ -370,10 +454,7 @@ class SpcPlugin(plugins.SingletonPlugin, DefaultTranslation):
 
         filepath = os.path.join(os.path.dirname(__file__), 'data/eez.json')
         if os.path.isfile(filepath):
-            with open(filepath) as file:
-                logger.debug('Updating EEZ list')
-                collection = json.load(file)
-                spc_utils.eez.update(collection['features'])
+            spc_utils.eez.load(filepath)
 
         toolkit.add_ckan_admin_tab(config_, 'search_queries.index',
                                    'Search Queries')
@@ -435,10 +516,16 @@ class SpcPlugin(plugins.SingletonPlugin, DefaultTranslation):
                 'dataset_type:dataset', 'dataset_type:({})'.format(' OR '.join(
                     [type for type in self.dataset_types])))
         search_params = spc_utils.params_into_advanced_search(search_params)
+
+        is_popular_first = toolkit.asbool(
+            search_params.get('extras', {}).get('ext_popular_first', False))
+        if is_popular_first:
+            search_params['sort'] = ', '.join(filter(None, [
+                'ga_view_count desc', search_params.get('sort')
+            ]))
         return search_params
 
     def after_search(self, results, params):
-        _org_cache = {}
         try:
             for item in results['search_facets']['type']['items']:
                 item['display_name'] = toolkit._(item['display_name'])
@@ -450,40 +537,33 @@ class SpcPlugin(plugins.SingletonPlugin, DefaultTranslation):
         except KeyError:
             pass
 
-        is_popular_first = toolkit.asbool(
-            params.get('extras', {}).get('ext_popular_first', False))
+        # Every lookup below is done once for the whole page, so amount
+        # of queries doesn't depend on the number of rows
+        ids = [item['id'] for item in results['results']]
+        tracking_summaries = spc_utils.tracking_summaries(ids)
+        stars = spc_utils.get_stars(results['results'])
+        ga_view_counts = spc_utils.ga_view_counts(
+            [item['name'] for item in results['results']])
+        part_of = _get_isPartOf_for_packages(results['results'])
+        organizations = spc_utils.org_cache.get_many({
+            item['organization']['name'] for item in results['results']
+        })
 
         for item in results['results']:
-            item['tracking_summary'] = (
-                model.TrackingSummary.get_for_package(item['id']))
+            item['tracking_summary'] = tracking_summaries[item['id']]
 
-            item['five_star_rating'] = spc_utils._get_stars_from_solr(
-                item['id'])
-            item['ga_view_count'] = spc_utils.ga_view_count(item['name'])
+            item['five_star_rating'] = stars[item['id']]
+            item['ga_view_count'] = ga_view_counts[item['name']]
             item['short_notes'] = h.truncate(item.get('notes', ''))
 
-            org_name = item['organization']['name']
-            try:
-                organization = _org_cache[org_name]
-            except KeyError:
-                organization = h.get_organization(org_name)
-                _org_cache[org_name] = organization
+            organization = organizations[item['organization']['name']] or {}
             item['organization_image_url'] = organization.get(
                 'image_display_url') or h.url_for_static(
                     '/base/images/placeholder-organization.png',
                     qualified=True)
 
-            if _package_is_native(item['id']):
-                item['isPartOf'] = 'pdh.pacificdatahub'
-            else:
-                src_type = _get_isPartOf(item['id'])
-                if src_type:
-                    item['isPartOf'] = src_type
-
-
-        if is_popular_first:
-            results['results'].sort(key=lambda i: i.get('ga_view_count', 0),
-                                    reverse=True)
+            if part_of[item['id']]:
+                item['isPartOf'] = part_of[item['id']]
 
         spc_utils.store_search_query(params)
 
@@ -493,6 +573,8 @@ class SpcPlugin(plugins.SingletonPlugin, DefaultTranslation):
         if plugins.plugin_loaded('ga-report'):
             pkg_dict['extras_ga_view_count'] = spc_utils.ga_view_count(
                 pkg_dict['name'])
+            # numeric copy, used for sorting
+            pkg_dict['ga_view_count'] = pkg_dict['extras_ga_view_count']
 
         topic_str = pkg_dict.get('thematic_area_string', '[]')
         if isinstance(topic_str, string_types):
@@ -500,8 +582,22 @@ class SpcPlugin(plugins.SingletonPlugin, DefaultTranslation):
         else:
             pkg_dict['topic'] = topic_str
 
-        pkg_dict.update(
-            extras_five_star_rating=spc_utils.count_stars(pkg_dict))
+        # rating is computed in background, because it depends on
+        # availability of resources
+        rating = FiveStarRating.get(pkg_dict['id'])
+        if rating is None:
+            _enqueue_five_star_rating(pkg_dict['id'])
+            rating = 0
+        pkg_dict.update(extras_five_star_rating=rating)
+        spc_utils.update_indexed_data(pkg_dict, five_star_rating=rating)
+
+        if toolkit.asbool(config.get('spc.index.is_part_of')):
+            part_of = spc_utils.harvest_index.get(
+                [pkg_dict])[pkg_dict['id']]
+            if part_of:
+                pkg_dict['extras_isPartOf'] = part_of
+                spc_utils.update_indexed_data(pkg_dict, isPartOf=part_of)
+
         if isinstance(pkg_dict.get('member_countries', '[]'), string_types):
             pkg_dict['member_countries'] = spc_helpers.countries_list(
                 pkg_dict.get('member_countries', '[]'))
@@ -510,16 +606,36 @@ class SpcPlugin(plugins.SingletonPlugin, DefaultTranslation):
 
         return pkg_dict
 
+    # IPackageController, IResourceController
+
+    def after_create(self, context, pkg_dict):
+        if not _is_package(pkg_dict):
+            return
+        spc_utils.harvest_index.invalidate_packages([pkg_dict['id']])
+
+    def after_update(self, context, pkg_dict):
+        if not _is_package(pkg_dict):
+            return
+        _enqueue_five_star_rating(pkg_dict['id'])
+        if pkg_dict.get('type') == 'harvest':
+            spc_utils.harvest_index.invalidate_source(pkg_dict['id'])
+        spc_utils.harvest_index.invalidate_packages([pkg_dict['id']])
+
+    def after_delete(self, context, pkg_dict):
+        if not _is_package(pkg_dict):
+            return
+        spc_utils.harvest_index.invalidate_source(pkg_dict['id'])
+        spc_utils.harvest_index.invalidate_packages([pkg_dict['id']])
+
     def after_show(self, context, pkg_dict):
-        pkg_dict['five_star_rating'] = spc_utils._get_stars_from_solr(
-            pkg_dict['id'])
+        pkg_dict['five_star_rating'] = spc_utils.get_stars(
+            [pkg_dict])[pkg_dict['id']]
 
         if not plugins.plugin_loaded('harvest'):
-            pkg_dict['isPartOf'] = 'pdh.pacificdatahub'
-        elif _package_is_native(pkg_dict['id']):
-            pkg_dict['isPartOf'] = 'pdh.pacificdatahub'
+            pkg_dict['isPartOf'] = spc_utils.NATIVE_PART_OF
         else:
-            src_type = _get_isPartOf(pkg_dict['id'])
+            src_type = _get_isPartOf_for_packages(
+                [pkg_dict])[pkg_dict['id']]
             if src_type:
                 pkg_dict['isPartOf'] = src_type
 
@@ -528,6 +644,15 @@ class SpcPlugin(plugins.SingletonPlugin, DefaultTranslation):
 
         return pkg_dict
 
+    # IPackageController, IOrganizationController
+
+    def edit(self, entity):
+        if isinstance(entity, model.Group) and entity.is_organization:
+            spc_utils.org_cache.clear()
+
+    def delete(self, entity):
+        self.edit(entity)
+
     # IFacets
 
     def dataset_facets(self, facets_dict, package_type):
@@ -563,16 +688,40 @@ class SpcPlugin(plugins.SingletonPlugin, DefaultTranslation):
         return get_commnads()
 
 
-def _package_is_native(id):
-    return not model.Session.query(HarvestObject).filter(
-        HarvestObject.package_id == id).count()
-
-def _get_isPartOf(id):
-    src_id = model.Session.query(HarvestObject.harvest_source_id) \
-                             .filter(HarvestObject.package_id == id) \
-                             .first()[0]
-    config = model.Session.query(HarvestSource.config) \
-                          .filter(HarvestSource.id == src_id) \
-                          .first()[0]
-    if config:
-        return json.loads(config).get('isPartOf')
+def _is_package(data_dict):
+    """Resource hooks share names with package hooks, but receive resource
+    dict(or list of resources on delete) instead.
+    """
+    return isinstance(data_dict, dict) and 'package_id' not in data_dict
+
+
+def _enqueue_five_star_rating(package_id):
+    """Enqueue rating job, unless there is one for the package already.
+    """
+    if not connect_to_redis().set(
+            spc_jobs.FIVE_STAR_RATING_PENDING.format(package_id), 1,
+            nx=True, ex=spc_jobs.FIVE_STAR_RATING_PENDING_TTL):
+        return
+    jobs.enqueue(
+        spc_jobs.update_five_star_rating, [package_id],
+        title='Five star rating of {}'.format(package_id)
+    )
+
+
+def _get_isPartOf_for_packages(pkg_dicts):
+    """Resolve `isPartOf` of every package from `pkg_dicts`.
+
+    When `spc.index.is_part_of` is enabled, value stored in search index is
+    used as is. Otherwise(or if package wasn't indexed with it) it's taken
+    from the in-process harvest index.
+    """
+    part_of = {}
+    if toolkit.asbool(config.get('spc.index.is_part_of')):
+        part_of.update(
+            (pkg['id'], pkg['isPartOf'])
+            for pkg in pkg_dicts if pkg.get('isPartOf')
+        )
+    part_of.update(spc_utils.harvest_index.get([
+        pkg for pkg in pkg_dicts if pkg['id'] not in part_of
+    ]))
+    return part_of
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+import ckan.tests.factories as factories
+import ckan.lib.helpers as helpers
+
+import ckanext.spc.utils as utils
+from ckanext.spc.tests.factories import create_request
+
+
+@pytest.mark.usefixtures("clean_db", "with_request_context")
+class TestDownloadTrackingExport(object):
+    def _track(self):
+        user = factories.User()
+        resource = factories.Resource()
+        buffer = utils._DownloadBuffer()
+        buffer.add(user["id"], resource["id"])
+        buffer.add(user["id"], resource["id"])
+        buffer.flush()
+        return user, resource
+
+    def test_csv(self, app):
+        sysadmin = factories.Sysadmin()
+        user, resource = self._track()
+        url = helpers.url_for(
+            "spc_export.package_download_tracking",
+            pkg_id=resource["package_id"], format="csv"
+        )
+        resp = app.get(
+            url, status=200, extra_environ={"REMOTE_USER": sysadmin["name"]}
+        )
+        lines = resp.body.splitlines()
+        assert lines[0].startswith("downloaded_at,user,")
+        assert len(lines) == 3
+        assert user["name"] in lines[1]
+
+    def test_jsonl(self, app):
+        sysadmin = factories.Sysadmin()
+        user, resource = self._track()
+        url = helpers.url_for(
+            "spc_export.package_download_tracking",
+            pkg_id=resource["package_id"], format="jsonl"
+        )
+        resp = app.get(
+            url, status=200, extra_environ={"REMOTE_USER": sysadmin["name"]}
+        )
+        rows = [json.loads(line) for line in resp.body.splitlines()]
+        assert [row["resource_id"] for row in rows] == [resource["id"]] * 2
+
+    def test_anon_is_not_authorized(self, app):
+        _user, resource = self._track()
+        url = helpers.url_for(
+            "spc_export.package_download_tracking",
+            pkg_id=resource["package_id"], format="csv"
+        )
+        app.get(url, status=403)
+
+
+@pytest.mark.usefixtures("clean_db", "with_request_context")
+class TestAccessRequestsExport(object):
+    def test_formulas_are_escaped(self, app):
+        sysadmin = factories.Sysadmin()
+        user = factories.User()
+        org = factories.Organization()
+        dataset = factories.Dataset(owner_org=org["id"])
+        create_request(
+            user_id=user["id"], package_id=dataset["id"], org_id=org["id"],
+            reason='=HYPERLINK("http://evil.example","x")'
+        )
+        url = helpers.url_for(
+            "spc_export.package_access_requests",
+            pkg_id=dataset["id"], format="csv"
+        )
+        resp = app.get(
+            url, status=200, extra_environ={"REMOTE_USER": sysadmin["name"]}
+        )
+        assert "'=HYPERLINK" in resp.body
+        assert '"=HYPERLINK' not in resp.body
@@ -79,3 +79,35 @@ class TestResourceRead(object):
 
         resp = app.get(url, status=200, extra_environ=env)
         assert resource['url'] in resp
+
+
+@pytest.mark.usefixtures("clean_db", "with_request_context")
+class TestResourceDownload(object):
+    def _url(self, resource):
+        return "/dataset/{}/resource/{}/download".format(
+            resource["package_id"], resource["id"]
+        )
+
+    def test_restricted_download_anon_user(self, app):
+        dataset = factories.Dataset(access="restricted")
+        resource = factories.Resource(package_id=dataset["id"])
+        app.get(self._url(resource), status=404)
+
+    def test_restricted_download_sysadmin(self, app):
+        sysadmin = factories.Sysadmin()
+        env = {"REMOTE_USER": sysadmin["name"]}
+        dataset = factories.Dataset(access="restricted")
+        resource = factories.Resource(package_id=dataset["id"])
+
+        resp = app.get(self._url(resource), status=302, extra_environ=env)
+        assert resp.headers["Location"] == resource["url"]
+
+    def test_resource_of_another_dataset(self, app):
+        resource = factories.Resource()
+        other = factories.Dataset()
+        app.get(
+            "/dataset/{}/resource/{}/download".format(
+                other["id"], resource["id"]
+            ),
+            status=404
+        )
@@ -5,6 +5,7 @@ import ckan.tests.factories as factories
 from ckan.logic import ValidationError, NotAuthorized
 
 import ckanext.spc.logic.action.get as get
+import ckanext.spc.utils as utils
 
 from ckanext.spc.model import AccessRequest
 from ckanext.spc.tests.factories import create_request
@@ -105,3 +106,86 @@ class TestGetAccessRequest:
             {'user': user['name']}, {'id': org['id']})
 
         assert len(res) == 1
+
+
+@pytest.mark.usefixtures("clean_db", "clean_index")
+class TestSpcPackageSearch:
+    def test_types_count(self):
+        factories.Dataset()
+        factories.Dataset()
+
+        result = get.spc_package_search({}, {})
+        assert result['count'] == 2
+        assert len(result['results']) == 2
+        assert result['types_count'] == {'dataset': 2}
+
+    def test_iter_package_search_continues_after_last_id(self):
+        ids = sorted(factories.Dataset()['id'] for _ in range(3))
+
+        pages = list(get.iter_package_search({}, {}, batch_size=2))
+        assert [pkg['id'] for page in pages for pkg in page['results']] == ids
+
+    def test_full_pull_keeps_requested_order(self):
+        names = [
+            factories.Dataset(name=name)["name"]
+            for name in ["ccc", "aaa", "bbb"]
+        ]
+
+        result = get.spc_package_search({}, {"sort": "name desc"})
+        assert [pkg["name"] for pkg in result["results"]] == sorted(
+            names, reverse=True
+        )
+        assert result["types_count"] == {"dataset": 3}
+
+        result = get.spc_package_search({}, {"sort": "name asc", "start": 1})
+        assert [pkg["name"] for pkg in result["results"]] == ["bbb", "ccc"]
+
+    @pytest.mark.parametrize("params", [
+        {"sort": "name asc"}, {"start": 10}, {"ext_popular_first": True},
+    ])
+    def test_iter_package_search_rejects_order(self, params):
+        with pytest.raises(ValidationError):
+            next(get.iter_package_search({}, params))
+
+    def test_facet_limit_does_not_hide_types(self):
+        factories.Dataset(tags=[{"name": "a"}])
+        factories.Dataset(tags=[{"name": "b"}])
+
+        result = get.spc_package_search({}, {
+            "rows": 10, "facet.field": '["tags"]', "facet.limit": 1,
+        })
+        assert len(result["search_facets"]["tags"]["items"]) == 1
+        assert result["types_count"] == {"dataset": 2}
+
+
+@pytest.mark.usefixtures("clean_db")
+class TestDownloadTrackingList:
+    def test_pages_are_linked_by_cursor(self):
+        sysadmin = factories.Sysadmin()
+        user = factories.User()
+        resource = factories.Resource()
+        buffer = utils._DownloadBuffer()
+        for _ in range(3):
+            buffer.add(user["id"], resource["id"])
+        buffer.flush()
+
+        context = {"user": sysadmin["name"]}
+        data_dict = {"id": resource["package_id"], "limit": 2}
+        first = get.spc_download_tracking_list(context, data_dict)
+        assert first["count"] == 3
+        assert len(first["results"]) == 2
+        assert first["next"]
+
+        second = get.spc_download_tracking_list(
+            context, dict(data_dict, after=first["next"])
+        )
+        assert len(second["results"]) == 1
+        assert second["next"] is None
+
+    def test_invalid_cursor(self):
+        sysadmin = factories.Sysadmin()
+        pkg = factories.Dataset()
+        with pytest.raises(ValidationError):
+            get.spc_download_tracking_list(
+                {"user": sysadmin["name"]}, {"id": pkg["id"], "after": "x"}
+            )
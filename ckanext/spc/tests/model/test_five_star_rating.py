@@ -0,0 +1,17 @@
+import pytest
+
+from ckan.tests import factories
+
+from ckanext.spc.model import FiveStarRating
+
+
+@pytest.mark.usefixtures("clean_db")
+def test_rating_is_stored():
+    pkg = factories.Dataset()
+    assert FiveStarRating.get(pkg["id"]) is None
+
+    FiveStarRating.set(pkg["id"], 3)
+    assert FiveStarRating.get(pkg["id"]) == 3
+
+    FiveStarRating.set(pkg["id"], 1)
+    assert FiveStarRating.get(pkg["id"]) == 1
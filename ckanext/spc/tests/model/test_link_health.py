@@ -0,0 +1,19 @@
+from datetime import datetime, timedelta
+
+from ckanext.spc.model import LinkHealth
+
+
+def test_is_fresh():
+    now = datetime.utcnow()
+    health = LinkHealth(url="http://example.com", checked_at=now)
+    week_ago = now - timedelta(days=7)
+
+    assert health.is_fresh("http://example.com", None, week_ago)
+    assert health.is_fresh("http://example.com", week_ago, week_ago)
+    assert not health.is_fresh("http://example.com/other", None, week_ago)
+    assert not health.is_fresh(
+        "http://example.com", now + timedelta(seconds=1), week_ago
+    )
+    assert not health.is_fresh(
+        "http://example.com", None, now + timedelta(seconds=1)
+    )
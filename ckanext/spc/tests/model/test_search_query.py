@@ -1,5 +1,7 @@
 import pytest
-from ckanext.spc.model import SearchQuery
+from datetime import date
+
+from ckanext.spc.model import SearchQuery, SearchQueryRollup
 import ckan.model as model
 
 
@@ -25,3 +27,39 @@ def test_update_or_create():
 
     total = model.Session.query(SearchQuery).count()
     assert 2 == total
+
+
+@pytest.mark.usefixtures("clean_db")
+def test_increment_many():
+    SearchQuery.update_or_create("a")
+    model.Session.flush()
+
+    SearchQuery.increment_many({"a": 2, "b": 3})
+
+    counts = dict(model.Session.query(SearchQuery.query, SearchQuery.count))
+    assert counts == {"a": 3, "b": 3}
+
+
+@pytest.mark.usefixtures("clean_db")
+def test_top_keyset_pagination():
+    SearchQuery.increment_many({"a": 1, "b": 3, "c": 3, "d": 2})
+
+    page = SearchQuery.top(2).all()
+    assert [q.query for q in page] == ["b", "c"]
+
+    page = SearchQuery.top(2, after=(page[-1].count, page[-1].query)).all()
+    assert [q.query for q in page] == ["d", "a"]
+
+
+@pytest.mark.usefixtures("clean_db")
+def test_rollups():
+    wednesday = date(2020, 9, 2)
+    SearchQueryRollup.increment_many({"a": 1}, day=wednesday)
+    SearchQueryRollup.increment_many({"a": 2, "b": 1}, day=date(2020, 9, 3))
+
+    week = SearchQueryRollup.top(
+        "week", 10, period_start=date(2020, 8, 31)).all()
+    assert [(q.query, q.count) for q in week] == [("a", 3), ("b", 1)]
+
+    day = SearchQueryRollup.top("day", 10, period_start=wednesday).all()
+    assert [(q.query, q.count) for q in day] == [("a", 1)]
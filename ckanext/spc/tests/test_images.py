@@ -0,0 +1,36 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import ckanext.spc.images as images
+
+
+def _png(width, height):
+    stream = BytesIO()
+    Image.new("RGB", (width, height)).save(stream, format="PNG")
+    stream.seek(0)
+    return stream
+
+
+def test_logo_variants(monkeypatch, tmp_path):
+    monkeypatch.setattr(images, "get_storage_path", lambda: str(tmp_path))
+    variants = images.logo_variants(_png(1000, 500), "PNG")
+
+    assert list(variants) == ["header", "thumbnail"]
+    assert Image.open(variants["header"]).size == (350, 175)
+    assert Image.open(variants["thumbnail"]).size == (200, 100)
+
+    cached = list((tmp_path / "storage" / "uploads" / "spc_logos").glob("*/*/*"))
+    assert sorted(path.name for path in cached) == [
+        "header.png", "thumbnail.png"
+    ]
+    # same content is not processed again
+    monkeypatch.setattr(images.Image, "open", pytest.fail)
+    assert images.logo_variants(_png(1000, 500), "PNG")["thumbnail"].read()
+
+
+def test_small_logo_is_not_enlarged(monkeypatch):
+    monkeypatch.setattr(images, "get_storage_path", lambda: None)
+    variants = images.logo_variants(_png(100, 100), "PNG")
+    assert Image.open(variants["header"]).size == (100, 100)
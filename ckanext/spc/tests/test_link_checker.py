@@ -0,0 +1,20 @@
+from ckanext.spc.link_checker import LinkChecker
+
+
+def test_dead_host_is_skipped(monkeypatch):
+    checker = LinkChecker(workers=1, max_host_failures=2)
+    probed = []
+
+    def fake_probe(url, headers):
+        probed.append(url)
+        if "dead.example.com" in url:
+            return (520, "Connection Error"), True
+        return None, False
+
+    monkeypatch.setattr(checker, "_probe", fake_probe)
+    dead = ["http://dead.example.com/{}".format(i) for i in range(5)]
+    results = checker.check_many(dead + ["http://example.com/ok"])
+
+    assert results["http://example.com/ok"] is None
+    assert all(results[url] == (520, "Connection Error") for url in dead)
+    assert len([url for url in probed if url in dead]) == 2
@@ -1,5 +1,97 @@
 """Tests for plugin.py."""
+import uuid
+from io import BytesIO
+
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+import ckan.lib.uploader as uploader
+from ckan.lib.redis import connect_to_redis
+import ckan.tests.factories as factories
+import ckan.tests.helpers as helpers
+
+import ckanext.spc.images as images
+import ckanext.spc.jobs as spc_jobs
+import ckanext.spc.plugin as plugin
 
 
 def test_plugin():
     pass
+
+
+@pytest.mark.usefixtures("clean_db")
+def test_resource_hooks_are_not_treated_as_package_hooks(monkeypatch):
+    enqueued = []
+    monkeypatch.setattr(
+        plugin, "_enqueue_five_star_rating", enqueued.append
+    )
+    dataset = factories.Dataset()
+    resource = factories.Resource(package_id=dataset["id"])
+
+    helpers.call_action("resource_patch", id=resource["id"], name="New")
+    assert resource["id"] not in enqueued
+
+    helpers.call_action("resource_delete", id=resource["id"])
+    pkg = helpers.call_action("package_show", id=dataset["id"])
+    assert pkg["resources"] == []
+
+
+def test_five_star_rating_job_is_enqueued_once(monkeypatch):
+    enqueued = []
+    monkeypatch.setattr(
+        plugin.jobs, "enqueue",
+        lambda func, args, **kwargs: enqueued.append(args)
+    )
+    package_id = str(uuid.uuid4())
+    plugin._enqueue_five_star_rating(package_id)
+    plugin._enqueue_five_star_rating(package_id)
+    assert enqueued == [[package_id]]
+
+    # job releases the package as soon as it starts
+    connect_to_redis().delete(
+        spc_jobs.FIVE_STAR_RATING_PENDING.format(package_id)
+    )
+    plugin._enqueue_five_star_rating(package_id)
+    assert len(enqueued) == 2
+    connect_to_redis().delete(
+        spc_jobs.FIVE_STAR_RATING_PENDING.format(package_id)
+    )
+
+
+def _upload_logo(filename, format, old_filename=None, upload_to="group"):
+    stream = BytesIO()
+    Image.new("RGB", (1000, 500)).save(stream, format=format)
+    stream.seek(0)
+    upload = plugin.Upload(upload_to, old_filename)
+    data_dict = {"image_upload": FileStorage(stream, filename)}
+    upload.update_data_dict(
+        data_dict, "image_url", "image_upload", "clear_upload"
+    )
+    upload.upload()
+    return data_dict["image_url"]
+
+
+def test_logo_variants_are_replaced(monkeypatch, tmp_path):
+    monkeypatch.setattr(uploader, "get_storage_path", lambda: str(tmp_path))
+    monkeypatch.setattr(images, "get_storage_path", lambda: None)
+    folder = tmp_path / "storage" / "uploads" / "group"
+
+    png = _upload_logo("logo.png", "PNG")
+    assert (folder / ("thumbnail-" + png)).exists()
+
+    # GIF is stored as is, while variants of the replaced logo are removed
+    gif = _upload_logo("logo.gif", "GIF", png)
+    assert gif.endswith(".gif")
+    assert Image.open(str(folder / gif)).format == "GIF"
+    assert not list(folder.glob("thumbnail-*"))
+
+
+def test_site_logo_is_resized(monkeypatch, tmp_path):
+    monkeypatch.setattr(uploader, "get_storage_path", lambda: str(tmp_path))
+    monkeypatch.setattr(images, "get_storage_path", lambda: None)
+    folder = tmp_path / "storage" / "uploads" / "admin"
+
+    logo = _upload_logo("logo.png", "PNG", upload_to="admin")
+    assert Image.open(str(folder / logo)).size == (350, 175)
+    assert not list(folder.glob("thumbnail-*"))
@@ -1,4 +1,13 @@
+import itertools
+import json
+import time
+
+import pytest
+
+import ckan.tests.factories as factories
+
 import ckanext.spc.utils as utils
+from ckanext.spc.model import DownloadTracking, SearchQuery
 
 
 def test_normalize_res():
@@ -42,3 +51,301 @@ def test_normalize_search_query():
     assert "a a" == utils._normalize_search_query("A A")
     assert "a a" == utils._normalize_search_query("a a")
     assert "a a" == utils._normalize_search_query("      a            A    ")
+
+
+@pytest.mark.usefixtures("clean_db")
+def test_tracking_summaries_without_tracking():
+    assert utils.tracking_summaries([]) == {}
+    assert utils.tracking_summaries(["a", "b"]) == {
+        "a": {"total": 0, "recent": 0},
+        "b": {"total": 0, "recent": 0},
+    }
+
+
+def test_get_stars_uses_loaded_rating():
+    pkgs = [dict(id="a", five_star_rating=3), dict(id="b", five_star_rating=0)]
+    assert utils.get_stars(pkgs) == {"a": 3, "b": 0}
+
+
+def test_update_indexed_data():
+    pkg = dict(data_dict='{"id": "a"}', validated_data_dict='{"id": "a"}')
+    utils.update_indexed_data(pkg, five_star_rating=4)
+    assert json.loads(pkg["data_dict"]) == {"id": "a", "five_star_rating": 4}
+    assert json.loads(pkg["validated_data_dict"]) == {
+        "id": "a", "five_star_rating": 4
+    }
+
+
+@pytest.mark.usefixtures("clean_db")
+def test_harvest_index_native_package():
+    utils.harvest_index.clear()
+    pkg = factories.Dataset()
+    assert utils.harvest_index.get([pkg]) == {
+        pkg["id"]: utils.NATIVE_PART_OF
+    }
+
+
+@pytest.mark.usefixtures("clean_db")
+def test_org_cache():
+    utils.org_cache.clear()
+    org = factories.Organization()
+    summary = utils.org_cache.get(org["name"])
+    assert summary["id"] == org["id"]
+    assert summary["title"] == org["title"]
+    assert utils.org_cache.get(org["id"]) is summary
+    assert utils.org_cache.get("not-a-real-org") is None
+
+
+@pytest.mark.usefixtures("clean_db")
+def test_package_access():
+    dataset = factories.Dataset(access="restricted")
+    access = utils.package_access(dataset["name"])
+    assert access["id"] == dataset["id"]
+    assert access["restricted"]
+    assert utils.package_access(dataset["id"]) == access
+
+    public = factories.Dataset(access="public")
+    assert not utils.package_access(public["id"])["restricted"]
+    assert utils.package_access("not-a-real-dataset") is None
+
+
+def test_drupal_sessions():
+    sessions = utils._DrupalSessionCache()
+    assert sessions.get("sid") is None
+    sessions.set("sid", "user")
+    assert sessions.get("sid") == "user"
+    assert sessions.get("other-sid") is None
+    sessions.invalidate("sid")
+    assert sessions.get("sid") is None
+
+
+def test_link_probe(monkeypatch):
+    probe = utils._LinkProbe()
+    probe.clear()
+    probed = []
+
+    def fake_probe(url):
+        probed.append(url)
+        return 404 if "missing" in url else 200
+
+    monkeypatch.setattr(probe, "_probe", fake_probe)
+    urls = ["http://example.com/a", "http://example.com/missing", None]
+    assert probe.check_many(urls) == {
+        urls[0]: True, urls[1]: False, None: False
+    }
+    assert sorted(probed) == sorted(urls[:2])
+    # fresh results are reused, even by another process
+    other = utils._LinkProbe()
+    monkeypatch.setattr(other, "_probe", fake_probe)
+    assert other.check(urls[1]) is False
+    assert len(probed) == 2
+
+
+@pytest.mark.usefixtures("clean_db")
+def test_download_buffer():
+    user = factories.User()
+    resource = factories.Resource()
+    buffer = utils._DownloadBuffer()
+    buffer.add(user["id"], resource["id"])
+    buffer.add(user["id"], resource["id"])
+    assert not DownloadTracking.query(id=resource["package_id"]).count()
+
+    buffer.flush()
+    assert DownloadTracking.query(id=resource["package_id"]).count() == 2
+
+
+@pytest.mark.usefixtures("clean_db")
+@pytest.mark.ckan_config("spc.download_tracking.flush_interval", "1")
+def test_download_buffer_is_flushed_periodically():
+    user = factories.User()
+    resource = factories.Resource()
+    buffer = utils._DownloadBuffer()
+    buffer.add(user["id"], resource["id"])
+
+    for _ in range(50):
+        if DownloadTracking.query(id=resource["package_id"]).count():
+            break
+        time.sleep(0.1)
+    assert DownloadTracking.query(id=resource["package_id"]).count() == 1
+
+
+@pytest.mark.usefixtures("clean_db")
+@pytest.mark.ckan_config("spc.search_queries.flush_interval", "1")
+def test_search_query_buffer_is_flushed_in_background():
+    buffer = utils._SearchQueryBuffer()
+    buffer.add("water")
+    assert SearchQuery.top(10).count() == 0
+
+    for _ in range(50):
+        if SearchQuery.top(10).count():
+            break
+        time.sleep(0.1)
+    assert [(row.query, row.count) for row in SearchQuery.top(10)] == [
+        ("water", 1)
+    ]
+
+
+@pytest.mark.ckan_config("spc.download_tracking.max_buffer_size", "2")
+def test_download_buffer_is_bounded():
+    buffer = utils._DownloadBuffer()
+    for _ in range(3):
+        buffer.add("user-id", "resource-id")
+    assert len(buffer._rows) == 2
+    assert buffer.dropped == 1
+
+
+def test_compile_advanced_search():
+    compile = utils.compile_advanced_search
+    assert compile([]) == []
+    assert compile([("a", "or")]) == ["a"]
+    assert compile([("b", "and"), ("a", "and"), ("c", "or")]) == [
+        "a", "b", "c"
+    ]
+    assert compile([("b", "or"), ("a", "and")]) == ["(a OR b)"]
+    assert compile([("a", "and"), ("c", "or"), ("b", "or")]) == [
+        "(b OR c)", "a"
+    ]
+    assert compile([("a", "or"), ("b", "and"), ("c", "or")]) == [
+        "((b AND c) OR a)"
+    ]
+
+
+def _legacy_advanced_search(rows):
+    """Nested `f1 op1 (f2 op2 (...))` fq, built before clauses were compiled.
+    """
+    fq = ""
+    for fragment, operator in reversed(rows):
+        if not fq:
+            fq = "never:match" if operator == "or" else "*:*"
+        fq = f"{fragment} {operator.upper()} ({fq})"
+    return fq
+
+
+def _matches(clause, values):
+    expr = clause.replace("never:match", "False").replace("*:*", "True")
+    expr = expr.replace(" AND ", " and ").replace(" OR ", " or ")
+    return eval(expr, {}, values)
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 4])
+def test_compile_advanced_search_is_equivalent_to_legacy(size):
+    fragments = ["a", "b", "c"]
+    for rows in itertools.product(
+            itertools.product(fragments, ["and", "or"]), repeat=size):
+        legacy = _legacy_advanced_search(rows)
+        clauses = utils.compile_advanced_search(rows)
+        for flags in itertools.product([True, False], repeat=len(fragments)):
+            values = dict(zip(fragments, flags))
+            assert _matches(legacy, values) == all(
+                _matches(clause, values) for clause in clauses
+            ), rows
+
+
+def _eez_feature(territory, iso, coordinates=None, geoname=""):
+    return {
+        "properties": {
+            "Territory1": territory,
+            "ISO_Ter1": iso,
+            "GeoName": geoname,
+        },
+        "geometry": {
+            "type": "Point",
+            "coordinates": coordinates or [0, 0],
+        },
+    }
+
+
+def test_eez_indexes():
+    huge = [[i, i] for i in range(5000)]
+    features = [
+        _eez_feature("B", "BBB"),
+        _eez_feature("A", "AAA"),
+        _eez_feature("C", "CCC", huge),
+    ]
+    index = utils._EEZ([])
+    index.update(features, [[[0, f["geometry"]]] for f in features])
+
+    assert [o["text"] for o in index.options] == ["A", "B"]
+    assert index.by_iso["AAA"] is features[1]
+    assert index.options_by_territory["B"]["value"] == json.dumps(
+        features[0]["geometry"]
+    )
+    assert "C" in index.geometries
+    assert "C" not in index.options_by_territory
+
+
+def test_eez_simplified_geometry():
+    huge = [[i, i] for i in range(5000)]
+    feature = _eez_feature("A", "AAA", huge)
+    levels = [[
+        [0, feature["geometry"]],
+        [0.01, {"type": "Point", "coordinates": huge[:2000]}],
+        [0.1, {"type": "Point", "coordinates": huge[:10]}],
+    ]]
+    index = utils._EEZ([])
+    index.update([feature], levels)
+
+    medium = json.dumps(levels[0][1][1])
+    assert index.simplified_geometry(feature, 1) == json.dumps(
+        levels[0][2][1]
+    )
+    assert index.simplified_geometry(feature, 0.05) == medium
+    # nothing within tolerance fits, so accuracy is sacrificed
+    assert index.simplified_geometry(feature, 0.005) == medium
+    assert index.simplified_geometry(feature, 0.005, 0.1) is None
+    assert index.options_by_territory["A"]["value"] == medium
+
+
+def test_eez_features_by_names():
+    features = [
+        _eez_feature("Fiji", "FJI", geoname="Fijian Exclusive Economic Zone"),
+        _eez_feature("Samoa", "WSM", geoname="Samoan Exclusive Economic Zone"),
+        _eez_feature(
+            "American Samoa", "ASM",
+            geoname="United States Exclusive Economic Zone (American Samoa)"
+        ),
+    ]
+    index = utils._EEZ(features)
+
+    assert index.features_by_names(["Samoa"]) == [features[1]]
+    assert index.features_by_names("fiji") == [features[0]]
+    # collection order is kept, whatever the order of names
+    assert index.features_by_names(["American Samoa", "Fiji"]) == [
+        features[0], features[2]
+    ]
+    assert index.features_by_names("ameri sam") == [features[2]]
+    assert index.iso_codes(index.features_by_names(["Samoan", "Samoa"])) == [
+        "WSM"
+    ]
+    assert index.iso_codes(index.features_by_names(["economic zone"])) == [
+        "FJI", "WSM", "ASM"
+    ]
+    assert index.features_by_names(["Tonga", None]) == []
+
+
+def test_member_countries():
+    assert utils.member_countries(["Samoa", "Fiji", "Atlantis"]) == [
+        "FJ", "WS"
+    ]
+    assert utils.member_countries("Tonga", "publications") == ["TO"]
+    assert utils.member_countries([]) == ["other"]
+
+
+def test_eez_spatial_queries():
+    pytest.importorskip("shapely")
+    square = {
+        "type": "Polygon",
+        "coordinates": [[[0, 0], [0, 10], [10, 10], [10, 0], [0, 0]]],
+    }
+    features = [_eez_feature("A", "AAA"), _eez_feature("B", "BBB")]
+    features[0]["geometry"] = square
+    features[1]["geometry"] = {
+        "type": "Polygon",
+        "coordinates": [[[20, 0], [20, 10], [30, 10], [30, 0], [20, 0]]],
+    }
+    index = utils._EEZ(features)
+
+    assert index.features_at(5, 5) == [features[0]]
+    assert index.features_at(15, 5) == []
+    assert index.features_in_bbox(5, 5, 25, 6) == features
+    assert index.features_intersecting(square) == [features[0]]
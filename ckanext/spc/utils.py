@@ -1,9 +1,21 @@
+import atexit
+import bisect
+import datetime
+import hashlib
+import itertools
+import json
 import logging
+import numbers
+import threading
 import os
 import tempfile
 import requests
+import requests.adapters
+import six
 import re
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from smtplib import SMTPServerDisconnected
 from operator import attrgetter, itemgetter
 
@@ -18,7 +30,13 @@ from ckan.lib.uploader import get_resource_uploader
 from ckan.lib import mailer
 
 from ckanext.ga_report.ga_model import GA_Url
-from ckanext.spc.model import SearchQuery, DownloadTracking
+from ckanext.scheming.helpers import (
+    scheming_get_dataset_schema, scheming_field_by_name, scheming_field_choices
+)
+from ckanext.harvest.model import HarvestObject, HarvestSource
+from ckanext.spc.model import (
+    SearchQuery, SearchQueryRollup, DownloadTracking, DownloadRollup
+)
 
 logger = logging.getLogger(__name__)
 
@@ -43,25 +61,192 @@ structured_formats = {
 }
 
 
+# Keep amount of boolean clauses inside single SOLR query below default
+# `maxBooleanClauses` limit
+_SOLR_IDS_CHUNK = 500
+
+
 def _get_stars_from_solr(id):
-    results = query_for('package').run({
-        'q': 'id:' + id,
-        'fl': 'extras_five_star_rating'
-    })['results']
+    return get_stars_from_solr([id])[id]
+
+
+def get_stars(pkg_dicts):
+    """Get rating of every package from `pkg_dicts`.
+
+    `before_index` stores the rating inside indexed package data, so
+    dicts that came from search index(search results, cached
+    `package_show`) already contain it. SOLR is queried only for the
+    packages that miss the rating.
+    """
+    stars = {}
+    missing = []
+    for pkg_dict in pkg_dicts:
+        try:
+            stars[pkg_dict['id']] = int(pkg_dict['five_star_rating'])
+        except (KeyError, TypeError, ValueError):
+            missing.append(pkg_dict['id'])
+    stars.update(get_stars_from_solr(missing))
+    return stars
+
+
+def update_indexed_data(pkg_dict, **fields):
+    """Add `fields` to the package data that is stored in search index.
+
+    This data is used as a source for search results and for cached
+    `package_show`, so added fields are available without extra lookups.
+    """
+    for key in ('data_dict', 'validated_data_dict'):
+        if not pkg_dict.get(key):
+            continue
+        data = json.loads(pkg_dict[key])
+        data.update(fields)
+        pkg_dict[key] = json.dumps(data)
+    return pkg_dict
+
+
+def search_by_ids(ids, fl):
+    """Yield indexed documents of packages from `ids`.
+
+    Packages are requested in chunks, so there is a single SOLR request
+    for the whole page of search results instead of request per package.
+    """
+    for start in range(0, len(ids), _SOLR_IDS_CHUNK):
+        chunk = ids[start:start + _SOLR_IDS_CHUNK]
+        for result in query_for('package').run({
+                'q': 'id:({})'.format(' OR '.join(
+                    '"{}"'.format(id) for id in chunk
+                )),
+                'fl': 'id ' + fl,
+                'rows': len(chunk),
+        })['results']:
+            yield result
+
+
+def get_stars_from_solr(ids):
+    """Fetch indexed rating of every package from `ids`.
+    """
+    stars = dict.fromkeys(ids, 0)
     try:
-        return int(results[0]['extras']['five_star_rating'])
+        results = list(search_by_ids(ids, 'extras_five_star_rating'))
     except Exception as e:
-        logger.warn('Unable to get rating of <{}>: {}'.format(id, e))
-        return 0
+        logger.warn('Unable to get rating of <{}>: {}'.format(ids, e))
+        return stars
+
+    for result in results:
+        try:
+            stars[result['id']] = int(result['extras']['five_star_rating'])
+        except Exception as e:
+            logger.warn('Unable to get rating of <{}>: {}'.format(
+                result.get('id'), e
+            ))
+    return stars
+
+
+class _LinkProbe:
+    """Availability checks of external links.
+
+    Links are checked concurrently through a pooled session. Status of
+    every link is kept in Redis for `spc.link_probe.ttl` seconds, so
+    rating jobs and web workers reuse recent checks instead of hitting
+    remote servers again.
+    """
+
+    timeout = 2
+    prefix = 'spc:link_probe:'
+
+    def __init__(self):
+        self._session = None
+        self._lock = threading.Lock()
+
+    def clear(self):
+        from ckan.lib.redis import connect_to_redis
+
+        redis = connect_to_redis()
+        for key in redis.scan_iter(self.prefix + '*'):
+            redis.delete(key)
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                workers = self._workers()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=workers, pool_maxsize=workers
+                )
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+        return self._session
+
+    def check(self, url):
+        return self.check_many([url])[url]
+
+    def check_many(self, urls):
+        """Check every URL from `urls`.
+
+        Returns dict of URLs and their availability.
+        """
+        from ckan.lib.redis import connect_to_redis
+
+        available = {}
+        remote = []
+        for url in set(urls):
+            if not url:
+                available[url] = False
+            elif h.url_is_local(url):
+                available[url] = True
+            else:
+                remote.append(url)
+        if not remote:
+            return available
+
+        redis = connect_to_redis()
+        stale = []
+        for url, status in zip(
+                remote, redis.mget([self._key(url) for url in remote])):
+            if status is None:
+                stale.append(url)
+            else:
+                available[url] = _is_ok_status(int(status))
+        if not stale:
+            return available
+
+        ttl = tk.asint(config.get('spc.link_probe.ttl', 3600))
+        pipe = redis.pipeline()
+        with ThreadPoolExecutor(min(len(stale), self._workers())) as executor:
+            for url, status in zip(stale, executor.map(self._probe, stale)):
+                # unreachable links are stored as 0
+                pipe.setex(self._key(url), ttl, status or 0)
+                available[url] = _is_ok_status(status)
+        pipe.execute()
+        return available
+
+    def _key(self, url):
+        return self.prefix + hashlib.sha1(six.ensure_binary(url)).hexdigest()
+
+    def _probe(self, url):
+        """Status code of HEAD response or None, if link is unreachable.
+        """
+        try:
+            return self.session.head(url, timeout=self.timeout).status_code
+        except Exception:
+            return None
+
+    @staticmethod
+    def _workers():
+        return tk.asint(config.get('spc.link_probe.workers', 8))
+
+
+def _is_ok_status(status):
+    return bool(status) and status < 400
+
+
+link_probe = _LinkProbe()
 
 
 def check_link(url):
-    try:
-        if not h.url_is_local(url):
-            requests.head(url, timeout=2).raise_for_status()
-    except Exception:
-        return False
-    return True
+    return link_probe.check(url)
 
 
 def count_stars(pkg_dict):
@@ -159,20 +344,758 @@ def ga_view_count(name):
              GA_Url.package_id == name).scalar() or 0
 
 
+def ga_view_counts(names):
+    """Fetch GA views of every package from `names` using single query.
+    """
+    counts = dict.fromkeys(names, 0)
+    if not names:
+        return counts
+    query = model.Session.query(
+        GA_Url.package_id, GA_Url.pageviews
+    ).filter(GA_Url.period_name == 'All',
+             GA_Url.package_id.in_(names))
+    for name, pageviews in query:
+        counts[name] = pageviews or 0
+    return counts
+
+
+def tracking_summaries(ids):
+    """Bulk version of `model.TrackingSummary.get_for_package`.
+
+    Returns the latest tracking summary of every package from `ids`.
+    """
+    summaries = {id: {'total': 0, 'recent': 0} for id in ids}
+    if not ids:
+        return summaries
+    TrackingSummary = model.TrackingSummary
+    query = model.Session.query(
+        TrackingSummary.package_id,
+        TrackingSummary.running_total,
+        TrackingSummary.recent_views
+    ).autoflush(False).filter(
+        TrackingSummary.package_id.in_(ids)
+    ).distinct(TrackingSummary.package_id).order_by(
+        TrackingSummary.package_id, TrackingSummary.tracking_date.desc()
+    )
+    for id, total, recent in query:
+        summaries[id] = {'total': total, 'recent': recent}
+    return summaries
+
+
 class _EEZ:
+    """EEZ features together with lookup tables built from them.
+
+    Indexes are rebuilt only when collection is updated, so lookups and
+    predefined area options cost nothing at request time.
+    """
+
+    # SOLR doesn't accept spatial queries above this size(in KB)
+    max_geometry_size = 31
+
+    # Levels of detail(simplification tolerance in degrees) kept for
+    # every feature. Zero stands for the original geometry
+    tolerances = (0, 0.001, 0.005, 0.01, 0.05, 0.1)
 
     def __init__(self, collection):
-        self.collection = collection
+        self._source = None
+        self.update(collection)
 
-    def update(self, collection):
+    def update(self, collection, levels=None):
         self.collection = collection
+        if levels is None:
+            levels = _simplify_features(collection, self.tolerances)
+        self._levels = [[(tolerance, json.dumps(geometry))
+                         for tolerance, geometry in feature_levels]
+                        for feature_levels in levels]
+        self._build_indexes()
+
+    def load(self, filepath):
+        """Update collection from GeoJSON file, unless it's unchanged
+        since previous load.
+
+        Simplified geometries are cached next to the file, keyed by its
+        hash.
+        """
+        stat = os.stat(filepath)
+        source = (filepath, stat.st_mtime, stat.st_size)
+        if source == self._source:
+            return False
+        with open(filepath, 'rb') as file:
+            content = file.read()
+        logger.debug('Updating EEZ list')
+        collection = json.loads(content.decode('utf8'))['features']
+
+        cache_path = '{}.{}.levels.json'.format(
+            os.path.splitext(filepath)[0],
+            hashlib.sha1(content).hexdigest()[:16]
+        )
+        levels = _read_eez_levels(cache_path, self.tolerances)
+        if levels is None or len(levels) != len(collection):
+            levels = _simplify_features(collection, self.tolerances)
+            _write_eez_levels(cache_path, self.tolerances, levels)
+        self.update(collection, levels)
+        self._source = source
+        return True
+
+    def simplified_geometry(self, feature, tolerance=None, max_size=None):
+        """Serialized geometry of the feature in the coarsest level of
+        detail within `tolerance`.
+
+        When none of such levels is under `max_size`(in KB), the most
+        detailed level that fits is used. None is returned if even the
+        coarsest level is too big.
+        """
+        if tolerance is None:
+            tolerance = self.tolerance
+        if max_size is None:
+            max_size = self.max_geometry_size
+
+        fitting = [(level, geometry)
+                   for level, geometry in self._levels[self._position(feature)]
+                   if len(geometry) / 1024 <= max_size]
+        if not fitting:
+            return None
+        accurate = [
+            geometry for level, geometry in fitting if level <= tolerance
+        ]
+        return accurate[-1] if accurate else fitting[0][1]
+
+    def _position(self, feature):
+        return self._feature_positions[id(feature)]
+
+    def _build_indexes(self):
+        by_territory = {}
+        by_iso = {}
+        names = {}
+        tokens = {}
+        for position, feature in enumerate(self.collection):
+            props = feature['properties']
+            by_territory[props['Territory1']] = feature
+            by_iso[props['ISO_Ter1']] = feature
+            for name in (props['Territory1'], props.get('GeoName', '')):
+                words = _name_tokens(name)
+                names.setdefault(' '.join(words), set()).add(position)
+                for word in words:
+                    tokens.setdefault(word, set()).add(position)
+
+        self._names = names
+        self._tokens = tokens
+        # sorted, so words with the same prefix are found by bisection
+        self._sorted_tokens = sorted(tokens)
+        # spatial index is built on first spatial query
+        self._tree = None
+
+        self.by_iso = by_iso
+        self.geometries = {
+            territory: json.dumps(feature['geometry'])
+            for territory, feature in by_territory.items()
+        }
+        self._feature_positions = {
+            id(feature): position
+            for position, feature in enumerate(self.collection)
+        }
+        self.tolerance = float(config.get('spc.eez.tolerance', 0.01))
+
+        options = []
+        for territory, feature in sorted(by_territory.items()):
+            geometry = self.simplified_geometry(feature)
+            if geometry is None:
+                logger.warning((
+                    '[{}] has too long coordinates definition '
+                    'and will be excluded from predefined areas'
+                ).format(territory))
+                continue
+            options.append({'text': territory, 'value': geometry})
+        self.options = options
+        self.options_by_territory = {
+            option['text']: option for option in options
+        }
+
+    def features_by_names(self, names):
+        """Find features for every name from `names`(coverage values,
+        country labels, etc).
+
+        Name matches a feature, if it's equal to its territory or EEZ
+        name, or if every word of the name is a prefix of some word from
+        these names("Fiji" matches "Fijian"). Features are returned in the
+        order of the collection, no matter the order of `names`.
+        """
+        if isinstance(names, six.string_types):
+            names = [names]
+        found = set()
+        for name in names:
+            words = _name_tokens(name or '')
+            if not words:
+                continue
+            positions = self._names.get(' '.join(words))
+            if not positions:
+                positions = set.intersection(
+                    *[self._prefixed(word) for word in words]
+                )
+            found.update(positions)
+        return [self.collection[position] for position in sorted(found)]
+
+    def _prefixed(self, word):
+        positions = set()
+        start = bisect.bisect_left(self._sorted_tokens, word)
+        for token in itertools.islice(self._sorted_tokens, start, None):
+            if not token.startswith(word):
+                break
+            positions.update(self._tokens[token])
+        return positions
+
+    def iso_codes(self, features):
+        codes = []
+        for feature in features:
+            code = feature['properties']['ISO_Ter1']
+            if code not in codes:
+                codes.append(code)
+        return codes
+
+    def features_at(self, lon, lat):
+        """Features, which EEZ contains the point.
+        """
+        from shapely.geometry import Point
+        return self._query(Point(lon, lat))
+
+    def features_in_bbox(self, minx, miny, maxx, maxy):
+        """Features, which EEZ intersects the bounding box.
+        """
+        from shapely.geometry import box
+        return self._query(box(minx, miny, maxx, maxy))
+
+    def features_intersecting(self, geometry):
+        """Features, which EEZ intersects GeoJSON `geometry`.
+        """
+        from shapely.geometry import shape
+        return self._query(shape(geometry))
+
+    def _query(self, geometry):
+        if self._tree is None:
+            self._build_spatial_index()
+
+        positions = set()
+        for hit in self._tree.query(geometry):
+            # shapely<2 returns geometries instead of positions
+            if not isinstance(hit, numbers.Integral):
+                hit = self._positions[id(hit)]
+            positions.add(int(hit))
+        return [
+            self.collection[position] for position in sorted(positions)
+            if self._shapes[position].intersects(geometry)
+        ]
+
+    def _build_spatial_index(self):
+        from shapely.geometry import shape
+        from shapely.strtree import STRtree
+
+        self._shapes = [
+            shape(feature['geometry']) for feature in self.collection
+        ]
+        self._positions = {
+            id(item): position for position, item in enumerate(self._shapes)
+        }
+        self._tree = STRtree(self._shapes)
 
     def __iter__(self):
         return iter(self.collection)
 
 
+def _name_tokens(name):
+    return re.findall(r'\w+', name.lower())
+
+
+def _simplify_features(collection, tolerances):
+    """Levels of detail for every feature, as list of
+    `[tolerance, geometry]` pairs ordered from the most detailed one.
+
+    Topology-preserving simplification is used, so polygons remain
+    valid. Without shapely only original geometries are available.
+    """
+    if not collection:
+        return []
+    try:
+        from shapely.geometry import mapping, shape
+    except ImportError:
+        logger.warning(
+            'shapely is not installed, EEZ geometries will not be simplified'
+        )
+        return [[[0, feature['geometry']]] for feature in collection]
+
+    levels = []
+    for feature in collection:
+        geometry = shape(feature['geometry'])
+        feature_levels = [[0, feature['geometry']]]
+        for tolerance in tolerances:
+            if not tolerance:
+                continue
+            simplified = geometry.simplify(tolerance, preserve_topology=True)
+            if simplified.is_empty:
+                break
+            feature_levels.append([tolerance, mapping(simplified)])
+        levels.append(feature_levels)
+    return levels
+
+
+def _read_eez_levels(path, tolerances):
+    try:
+        with open(path) as file:
+            cached = json.load(file)
+    except (IOError, OSError, ValueError):
+        return None
+    if cached.get('tolerances') != list(tolerances):
+        return None
+    return cached['levels']
+
+
+def _write_eez_levels(path, tolerances, levels):
+    # Originals only means that shapely is missing. Don't cache them, so
+    # levels are computed once it's available
+    if all(len(feature_levels) < 2 for feature_levels in levels):
+        return
+    try:
+        with tempfile.NamedTemporaryFile(
+                'w', dir=os.path.dirname(path), delete=False) as file:
+            json.dump({'tolerances': list(tolerances), 'levels': levels}, file)
+        os.rename(file.name, path)
+    except (IOError, OSError) as e:
+        logger.warning('Cannot cache simplified EEZ geometries: %s', e)
+
+
 eez = _EEZ([])
 
+# package type -> member country labels and codes in the order of schema
+_member_country_choices = {}
+
+
+def member_countries(labels, package_type='dataset'):
+    """Codes of member countries, whose labels are listed in `labels`, or
+    `['other']` if there are no such countries.
+
+    Choices are read from the schema only once per package type.
+    """
+    if package_type not in _member_country_choices:
+        schema = scheming_get_dataset_schema(package_type)
+        field = scheming_field_by_name(
+            schema['dataset_fields'], 'member_countries'
+        )
+        _member_country_choices[package_type] = [
+            (choice['label'], choice['value'])
+            for choice in scheming_field_choices(field)
+        ]
+    if isinstance(labels, six.string_types):
+        labels = [labels]
+    labels = set(labels)
+    return [
+        value for label, value in _member_country_choices[package_type]
+        if label in labels
+    ] or ['other']
+
+NATIVE_PART_OF = 'pdh.pacificdatahub'
+
+
+class _HarvestIndex:
+    """In-process index package_id -> harvest_source_id -> `isPartOf`.
+
+    Package entries are stored together with `metadata_modified` of the
+    package, so re-harvested packages are reloaded even if harvest import
+    happened in another process. Parsed source configs live for
+    `spc.harvest.source_cache_ttl` seconds, unless source is updated by
+    the current process.
+    """
+
+    max_size = 100000
+
+    def __init__(self):
+        self._packages = {}
+        self._sources = {}
+
+    def clear(self):
+        self._packages.clear()
+        self._sources.clear()
+
+    def invalidate_packages(self, ids):
+        for id in ids:
+            self._packages.pop(id, None)
+
+    def invalidate_source(self, id):
+        self._sources.pop(id, None)
+
+    def get(self, pkg_dicts):
+        """Resolve `isPartOf` of every package from `pkg_dicts`.
+
+        Native packages are part of PDH. Harvested packages take the value
+        from config of their harvest source, or `None` if it's not there.
+        """
+        modified = {
+            pkg['id']: pkg.get('metadata_modified') for pkg in pkg_dicts
+        }
+        missing = [
+            id for id, stamp in modified.items()
+            if self._packages.get(id, (None, ))[0] != stamp
+        ]
+        if missing:
+            self._load_packages(missing, modified)
+
+        source_ids = {
+            self._packages[id][1] for id in modified
+        } - {None}
+        self._load_sources(source_ids)
+
+        return {
+            id: self._sources[self._packages[id][1]][0]
+            if self._packages[id][1] else NATIVE_PART_OF
+            for id in modified
+        }
+
+    def _load_packages(self, ids, modified):
+        if len(self._packages) > self.max_size:
+            self._packages.clear()
+
+        sources = dict.fromkeys(ids)
+        sources.update(model.Session.query(
+            HarvestObject.package_id, HarvestObject.harvest_source_id
+        ).filter(
+            HarvestObject.package_id.in_(ids)
+        ).distinct(HarvestObject.package_id).order_by(
+            HarvestObject.package_id
+        ))
+        for id, source_id in sources.items():
+            self._packages[id] = (modified[id], source_id)
+
+    def _load_sources(self, ids):
+        ttl = tk.asint(config.get('spc.harvest.source_cache_ttl', 300))
+        now = time.time()
+        missing = [
+            id for id in ids
+            if now - self._sources.get(id, (None, 0))[1] > ttl
+        ]
+        if not missing:
+            return
+        configs = dict.fromkeys(missing)
+        configs.update(model.Session.query(
+            HarvestSource.id, HarvestSource.config
+        ).filter(HarvestSource.id.in_(missing)))
+        for id, source_config in configs.items():
+            part_of = None
+            if source_config:
+                part_of = json.loads(source_config).get('isPartOf')
+            self._sources[id] = (part_of, now)
+
+
+harvest_index = _HarvestIndex()
+
+
+class _OrganizationCache:
+    """Cross-request cache of organization summaries.
+
+    Summary is a result of `group_dictize` without datasets, users, groups
+    and tags. It's enough for decorating search results and rendering
+    organization headers. Every summary is available both by id and by
+    name and lives for `spc.organization.cache_ttl` seconds, unless
+    organization is updated by the current process.
+    """
+
+    def __init__(self):
+        self._orgs = {}
+
+    def clear(self):
+        self._orgs.clear()
+
+    def get(self, name_or_id):
+        return self.get_many([name_or_id])[name_or_id]
+
+    def get_many(self, names_or_ids):
+        """Get summaries for every organization from `names_or_ids`.
+
+        Missing organizations are loaded with a single query. Unknown
+        names are mapped to `None`.
+        """
+        ttl = tk.asint(config.get('spc.organization.cache_ttl', 600))
+        now = time.time()
+        missing = {
+            key for key in names_or_ids
+            if now - self._orgs.get(key, (None, 0))[1] > ttl
+        }
+        if missing:
+            self._load(missing, now)
+        return {
+            key: self._orgs.get(key, (None, ))[0] for key in names_or_ids
+        }
+
+    def _load(self, names_or_ids, now):
+        # avoid circular imports
+        import ckan.lib.dictization.model_dictize as model_dictize
+
+        context = {'model': model, 'session': model.Session}
+        orgs = model.Session.query(model.Group).filter(
+            model.Group.is_organization.is_(True),
+            model.Group.name.in_(names_or_ids)
+            | model.Group.id.in_(names_or_ids)
+        )
+        for org in orgs:
+            summary = model_dictize.group_dictize(
+                org, context,
+                include_groups=False,
+                include_tags=False,
+                include_users=False,
+                packages_field=None
+            )
+            self._orgs[org.id] = self._orgs[org.name] = (summary, now)
+
+
+org_cache = _OrganizationCache()
+
+
+def package_access(name_or_id):
+    """Access descriptor of the package or None, if it doesn't exist.
+
+    Descriptor contains just enough to decide whether package is
+    restricted and who manages it: `id`, `name`, `private`, `state`,
+    `owner_org` and `restricted` flag. It's loaded with a single query
+    and never cached, so access decisions are always up to date.
+    """
+    row = model.Session.query(
+        model.Package.id, model.Package.name, model.Package.private,
+        model.Package.state, model.Package.owner_org,
+        model.PackageExtra.value
+    ).outerjoin(
+        model.PackageExtra,
+        (model.PackageExtra.package_id == model.Package.id)
+        & (model.PackageExtra.key == 'access')
+    ).filter(
+        (model.Package.id == name_or_id)
+        | (model.Package.name == name_or_id)
+    ).first()
+    if row is None:
+        return None
+    id, name, private, state, owner_org, access = row
+    return {
+        'id': id,
+        'name': name,
+        'private': private,
+        'state': state,
+        'owner_org': owner_org,
+        'restricted': access == 'restricted',
+    }
+
+
+class _DrupalSessionCache:
+    """Drupal session id to CKAN user name mapping.
+
+    Identified sessions are remembered for
+    `spc.drupal.session_cache_ttl` seconds, so Drupal DB is queried only
+    for new sessions. Session ids are kept hashed.
+    """
+
+    max_size = 10000
+
+    def __init__(self):
+        self._users = {}
+
+    def clear(self):
+        self._users.clear()
+
+    def get(self, sid):
+        ttl = tk.asint(config.get('spc.drupal.session_cache_ttl', 60))
+        name, cached_at = self._users.get(self._key(sid), (None, 0))
+        if time.time() - cached_at > ttl:
+            return None
+        return name
+
+    def set(self, sid, name):
+        if len(self._users) >= self.max_size:
+            self.clear()
+        self._users[self._key(sid)] = (name, time.time())
+
+    def invalidate(self, sid):
+        self._users.pop(self._key(sid), None)
+
+    @staticmethod
+    def _key(sid):
+        return hashlib.sha256(six.ensure_binary(sid)).hexdigest()
+
+
+drupal_sessions = _DrupalSessionCache()
+
+
+class _DrupalFooter:
+    """Last good footer exported by Drupal, shared by all workers via
+    Redis.
+
+    Reading never touches Drupal. Once the footer is older than
+    `spc.footer.refresh_interval` seconds(or missing), a background job
+    fetches it again, while stale footer is still served. Only one
+    refresh job is enqueued at a time.
+    """
+
+    refresh_timeout = 60
+
+    def get(self, drupal_url):
+        from ckan.lib.redis import connect_to_redis
+
+        redis = connect_to_redis()
+        cached = redis.get(self._key(drupal_url))
+        record = json.loads(cached) if cached else None
+
+        interval = tk.asint(config.get('spc.footer.refresh_interval', 3600))
+        if record is None or time.time() - record['fetched_at'] > interval:
+            self._schedule_refresh(redis, drupal_url)
+        return record and record['html']
+
+    def refresh(self, drupal_url):
+        """Fetch footer from Drupal and store it, if it's available.
+        """
+        from ckan.lib.redis import connect_to_redis
+
+        html = self._fetch(drupal_url)
+        redis = connect_to_redis()
+        if html is not None:
+            redis.set(self._key(drupal_url), json.dumps({
+                'html': html, 'fetched_at': time.time()
+            }))
+        redis.delete(self._key(drupal_url) + ':refresh')
+        return html
+
+    def _schedule_refresh(self, redis, drupal_url):
+        # avoid circular imports
+        import ckan.lib.jobs as jobs
+        from ckanext.spc.jobs import refresh_drupal_footer
+
+        if not redis.set(
+                self._key(drupal_url) + ':refresh', 1,
+                nx=True, ex=self.refresh_timeout):
+            return
+        jobs.enqueue(
+            refresh_drupal_footer, [drupal_url],
+            title='Refresh Drupal footer', rq_kwargs={
+                'timeout': self.refresh_timeout
+            }
+        )
+
+    @staticmethod
+    def _fetch(drupal_url):
+        r = None
+        try:
+            r = requests.get(
+                drupal_url + '/footer_export', verify=False, timeout=10
+            )
+        except requests.exceptions.Timeout:
+            logger.warning(drupal_url + '/footer_export connection timeout')
+        except requests.exceptions.TooManyRedirects:
+            logger.warning(drupal_url + '/footer_export too many redirects')
+        except requests.exceptions.RequestException as e:
+            logger.error(e)
+
+        if r:
+            footer = r.json()
+        else:
+            return None
+
+        if footer and 'main' in footer:
+            return footer['main'][0]
+
+    @staticmethod
+    def _key(drupal_url):
+        return 'spc:footer:' + hashlib.sha1(
+            six.ensure_binary(drupal_url)
+        ).hexdigest()
+
+
+drupal_footer = _DrupalFooter()
+
+
+def _start_flush_timer(timer_pid, flush, interval):
+    """Start daemon thread, that calls `flush` every `interval()` seconds,
+    unless current process already has one.
+
+    Threads don't survive fork, so every worker process starts its own
+    timer. Returns pid of the process, that owns the timer.
+    """
+    pid = os.getpid()
+    if timer_pid == pid:
+        return pid
+
+    def run():
+        while True:
+            time.sleep(interval())
+            try:
+                flush()
+            except Exception:
+                logger.exception('Periodic flush failed')
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return pid
+
+
+class _SearchQueryBuffer:
+    """Write-behind buffer for search query analytics.
+
+    Searches are counted in memory and written with a single upsert from
+    a background thread every `spc.search_queries.flush_interval` seconds
+    or as soon as there are `spc.search_queries.buffer_size` distinct
+    queries in the buffer. Whatever left in the buffer is written on
+    shutdown.
+    """
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._flushed_at = time.time()
+        self._flushing = False
+        self._timer_pid = None
+
+    @staticmethod
+    def _interval():
+        return tk.asint(config.get('spc.search_queries.flush_interval', 60))
+
+    def add(self, query):
+        interval = self._interval()
+        size = tk.asint(config.get('spc.search_queries.buffer_size', 1000))
+        with self._lock:
+            self._timer_pid = _start_flush_timer(
+                self._timer_pid, self._flush_pending, self._interval
+            )
+            self._counts[query] = self._counts.get(query, 0) + 1
+            is_due = not self._flushing and (
+                len(self._counts) >= size
+                or time.time() - self._flushed_at >= interval
+            )
+            if is_due:
+                self._flushing = True
+        if is_due:
+            thread = threading.Thread(target=self.flush)
+            thread.daemon = True
+            thread.start()
+
+    def _flush_pending(self):
+        with self._lock:
+            if self._flushing or not self._counts:
+                return
+            self._flushing = True
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            self._flushed_at = time.time()
+        try:
+            if counts:
+                with model.meta.engine.begin() as connection:
+                    SearchQuery.increment_many(counts, connection)
+                    SearchQueryRollup.increment_many(counts, connection)
+        except Exception:
+            logger.exception(
+                'Unable to store %s search queries', len(counts))
+        finally:
+            self._flushing = False
+
+
+search_query_buffer = _SearchQueryBuffer()
+atexit.register(search_query_buffer.flush)
+
 
 def store_search_query(search_params):
     logger.debug('after_search {}'.format(search_params))
@@ -187,9 +1110,8 @@ def store_search_query(search_params):
         q = _normalize_search_query(q)
         if not q:
             return
-        query = SearchQuery.update_or_create(q)
-        model.Session.commit()
-        return query
+        search_query_buffer.add(q)
+        return q
     except Exception:
         # Log exception but don't cause search request to fail
         logger.exception('An exception occurred while storing a search query')
@@ -264,27 +1186,27 @@ def notify_user(user, state, extra_vars):
 
 
 def _get_org_members(org_id):
-    data_dict = {
-        'id': org_id,
-        'include_groups': False,
-        'include_tags': False,
-        'include_followers': False,
-        'include_extras': False
-    }
-    orgs = logic.get_action('organization_show')(
-        {'ignore_auth': True}, data_dict)
+    org = org_cache.get(org_id)
+    if not org:
+        raise tk.ObjectNotFound()
 
-    member_ids = (
-        member['id'] for member in orgs['users']
-        if member['capacity'] in ('admin', 'editor')
+    members = model.Session.query(
+        model.User.name, model.User.email
+    ).join(
+        model.Member, model.Member.table_id == model.User.id
+    ).filter(
+        model.Member.group_id == org['id'],
+        model.Member.table_name == 'user',
+        model.Member.state == 'active',
+        model.Member.capacity.in_(['admin', 'editor']),
+        model.User.state == 'active'
     )
-    members = (model.User.get(_id) for _id in member_ids)
 
     return [
         {
-            'name': member.name,
-            'email': member.email
-        } for member in members
+            'name': name,
+            'email': email
+        } for name, email in members
     ]
 
 
@@ -317,8 +1239,11 @@ def notify_org_members(org_id, extra_vars):
 
 
 def delete_res_urls_if_restricted(context, data_dict):
+    # auth function needs only id and organization of the package
     try:
-        logic.check_access('restrict_dataset_show', context, data_dict)
+        logic.check_access('restrict_dataset_show', context, {
+            'id': data_dict['id'], 'owner_org': data_dict['owner_org']
+        })
         return data_dict
     except logic.NotAuthorized:
         pass
@@ -350,9 +1275,10 @@ def params_into_advanced_search(params):
     except KeyError:
         return params
     params.setdefault('fq', '')
-    fq = ''
+    rows = []
 
-    for value, type, operator in reversed(filters):
+    for value, type, operator in filters:
+        value = value.strip()
         if not value:
             continue
         if type == 'any':
@@ -365,18 +1291,141 @@ def params_into_advanced_search(params):
             if re.search(f'\\b{type}\\b', params['fq']):
                 continue
             fragment = f'{type}:"{value}"'
-        if not fq:
-            if operator == 'or':
-                fq = 'never:match'
+        rows.append((fragment, operator))
+
+    params.setdefault('fq_list', []).extend(compile_advanced_search(rows))
+    return params
+
+
+def compile_advanced_search(rows):
+    """Turn advanced search rows into the list of independent fq clauses.
+
+    Every row is a pair of query fragment and operator, that joins it with
+    the rest of the rows: `f1 op1 (f2 op2 (... fN))`. Leading AND-ed
+    fragments become separate clauses, so SOLR can cache and reuse them
+    independently. The rest is rendered as a single clause, with operands
+    of every AND/OR group sorted, so the same combination of filters
+    always produces the same string.
+    """
+    rows = [
+        (fragment, 'and' if operator.lower() == 'and' else 'or')
+        for fragment, operator in rows
+    ]
+    clauses = set()
+    while len(rows) > 1 and rows[0][1] == 'and':
+        clauses.add(rows.pop(0)[0])
+    if rows:
+        clauses.add(_render_advanced_search(rows))
+    return sorted(clauses)
+
+
+def _render_advanced_search(rows):
+    if len(rows) == 1:
+        return rows[0][0]
+    operator = rows[0][1]
+    operands = set()
+    while len(rows) > 1 and rows[0][1] == operator:
+        operands.add(rows.pop(0)[0])
+    operands.add(_render_advanced_search(rows))
+    if len(operands) == 1:
+        return operands.pop()
+    return '({})'.format(
+        ' {} '.format(operator.upper()).join(sorted(operands))
+    )
+
+
+class _DownloadBuffer:
+    """Write-behind buffer for resource downloads.
+
+    Downloads are collected in memory and written with a single
+    multi-row insert from a background thread every
+    `spc.download_tracking.flush_interval` seconds or as soon as there are
+    `spc.download_tracking.buffer_size` downloads in the buffer.
+
+    While flush is running or DB is unavailable, buffer grows up to
+    `spc.download_tracking.max_buffer_size` downloads. Anything above it
+    is dropped and counted in `dropped`.
+
+    Whatever left in the buffer is written on normal shutdown. Downloads
+    of the last few seconds are lost if the process is killed.
+    """
+
+    def __init__(self):
+        self._rows = []
+        self._lock = threading.Lock()
+        self._flushed_at = time.time()
+        self._flushing = False
+        self._timer_pid = None
+        self.dropped = 0
+
+    @staticmethod
+    def _interval():
+        return tk.asint(
+            config.get('spc.download_tracking.flush_interval', 10))
+
+    def add(self, user_id, resource_id):
+        interval = self._interval()
+        size = tk.asint(
+            config.get('spc.download_tracking.buffer_size', 500))
+        max_size = tk.asint(
+            config.get('spc.download_tracking.max_buffer_size', 10000))
+        with self._lock:
+            self._timer_pid = _start_flush_timer(
+                self._timer_pid, self._flush_pending, self._interval
+            )
+            if len(self._rows) >= max_size:
+                self.dropped += 1
+                dropped = self.dropped
             else:
-                fq = '*:*'
+                dropped = 0
+                self._rows.append({
+                    'user_id': user_id,
+                    'resource_id': resource_id,
+                    'downloaded_at': datetime.datetime.utcnow(),
+                })
+            is_due = not self._flushing and (
+                len(self._rows) >= size
+                or time.time() - self._flushed_at >= interval
+            )
+            if is_due:
+                self._flushing = True
+        if dropped % 1000 == 1:
+            logger.warning(
+                'Download buffer is full, %s downloads dropped so far',
+                dropped
+            )
+        if is_due:
+            thread = threading.Thread(target=self.flush)
+            thread.daemon = True
+            thread.start()
+
+    def _flush_pending(self):
+        with self._lock:
+            if self._flushing or not self._rows:
+                return
+            self._flushing = True
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows, self._rows = self._rows, []
+            self._flushed_at = time.time()
+        try:
+            if rows:
+                with model.meta.engine.begin() as connection:
+                    connection.execute(
+                        DownloadTracking.__table__.insert(), rows
+                    )
+                    DownloadRollup.increment_many(rows, connection)
+        except Exception:
+            logger.exception('Unable to store %s downloads', len(rows))
+        finally:
+            self._flushing = False
 
-        fq = f'{fragment} {operator.upper()} ({fq})'
 
-    params.setdefault('fq_list', []).append(fq)
-    return params
+download_buffer = _DownloadBuffer()
+atexit.register(download_buffer.flush)
+
 
-def track_resource_download(user, id):
-    record = DownloadTracking.download(user, id)
-    record.save()
-    return record
+def track_resource_download(user_id, resource_id):
+    download_buffer.add(user_id, resource_id)
@@ -1,15 +1,15 @@
 # -*- coding: utf-8 -*-
-import os
+import io
 import logging
 
-from datetime import datetime
-from flask import Blueprint, send_file
+from flask import Blueprint, Response
 
 import ckan.lib.jobs as jobs
 import ckan.model as model
 import ckan.lib.helpers as h
 import ckan.lib.plugins
 import ckan.lib.base as base
+import ckan.logic as logic
 
 from ckan.common import _, g, request
 from ckan.plugins import toolkit
@@ -17,9 +17,12 @@ from ckan.logic import NotAuthorized, check_access
 
 import ckanext.scheming.helpers as scheming_helpers
 
-from ckanext.spc.jobs import broken_links_report
-from ckanext.spc.model.search_query import SearchQuery
+from ckanext.spc.jobs import broken_links_report, write_broken_links_report
+from ckanext.spc.model.link_health import LinkHealth
+from ckanext.spc.model.search_query import SearchQuery, SearchQueryRollup
 from ckanext.spc.views.access_request import spc_access_request
+from ckanext.spc.views.export import spc_export
+from ckanext.spc.views.search import spc_search
 
 log = logging.getLogger(__name__)
 render = base.render
@@ -51,20 +54,22 @@ def broken_links():
         toolkit.check_access('sysadmin', {'user': g.user, model: model})
     except toolkit.NotAuthorized:
         return toolkit.abort(403)
-    filepath = toolkit.config['spc.report.broken_links_filepath']
-    try:
-        last_check = datetime.fromtimestamp(os.stat(filepath).st_mtime)
-    except OSError:
-        last_check = None
+    last_check = LinkHealth.last_check()
     active_jobs_count = jobs.get_queue(QUEUE_NAME).count
     if request.method == 'POST':
         action = request.form.get('action')
         if action == 'download' and last_check:
-            return send_file(
-                filepath,
-                as_attachment=True,
-                attachment_filename='SPC-BrokenLinks-{:%Y-%m-%d}.csv'.format(
-                    last_check))
+            # report is built from the results of the last checks, so it's
+            # always up to date
+            report = io.StringIO()
+            write_broken_links_report(report)
+            return Response(
+                report.getvalue(),
+                mimetype='text/csv',
+                headers={
+                    'Content-Disposition': 'attachment; filename='
+                    'SPC-BrokenLinks-{:%Y-%m-%d}.csv'.format(last_check)
+                })
 
         elif action == 'start':
             jobs.enqueue(broken_links_report,
@@ -101,29 +106,48 @@ def index():
         base.abort(403, _('Need to be system administrator'))
 
     if request.method == 'POST':
-        query_name = request.POST['q_name']
-        model.Session.query(SearchQuery).filter(
-            SearchQuery.query == query_name).delete()
+        query_name = request.form['q_name']
+        for table in (SearchQuery, SearchQueryRollup):
+            model.Session.query(table).filter(
+                table.query == query_name).delete()
         model.Session.commit()
         h.flash_success(_('The query has been removed'))
 
-    page = h.get_page_number(request.params)
-    total = model.Session.query(SearchQuery).count()
-    queries = model.Session.query(SearchQuery).order_by(
-        SearchQuery.count.desc()
-    ).limit(PER_PAGE).offset((page - 1) * PER_PAGE)
-    pager = h.Page(
-        collection=queries,
-        page=page,
-        url=lambda page: h.url_for('search_queries.index', page=page),
-        item_count=total,
-        items_per_page=PER_PAGE
-    )
+    period = request.args.get('period')
+    if period not in SearchQueryRollup.periods:
+        period = None
+
+    # keyset pagination: page starts right after the last row of the
+    # previous page
+    try:
+        after = (
+            int(request.args['after_count']), request.args['after_query']
+        )
+    except (KeyError, ValueError):
+        after = None
+
+    if period:
+        queries = SearchQueryRollup.top(period, PER_PAGE + 1, after)
+    else:
+        queries = SearchQuery.top(PER_PAGE + 1, after)
+    queries = queries.all()
+
+    next_url = None
+    if len(queries) > PER_PAGE:
+        queries = queries[:PER_PAGE]
+        next_url = h.url_for(
+            'search_queries.index',
+            period=period,
+            after_count=queries[-1].count,
+            after_query=queries[-1].query
+        )
 
     return render(
         'search_queries/index.html', {
             'queries': queries,
-            'pager': pager
+            'period': period,
+            'next_url': next_url,
+            'is_first_page': after is None
         }
     )
 
@@ -145,4 +169,4 @@ search_queries.add_url_rule(
 )
 
 blueprints = [spc_user, spc_admin,
-              search_queries, spc_access_request]
+              search_queries, spc_access_request, spc_search, spc_export]
@@ -1,9 +1,8 @@
 # -*- coding: utf-8 -*-
 import os
 import datetime as dt
-from functools import partial
 from dateutil import parser
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, send_file
 from flask.views import MethodView
 
 import ckan.model as model
@@ -16,7 +15,7 @@ import ckan.plugins.toolkit as tk
 from ckan.plugins.toolkit import ObjectNotFound
 from ckan.lib.base import abort, render
 from ckan.common import _, g, request, config
-import ckan.views.resource as resource_view
+from ckan.lib.uploader import get_resource_uploader
 import ckanext.spc.utils as utils
 
 spc_access_request = Blueprint('spc_access_request', __name__)
@@ -86,8 +85,13 @@ class BulkRequest(MethodView):
             package_dict['num_followers'] = logic.get_action('dataset_follower_count')(
                 self.context, data_dict)
             return package_dict
-        group = model.Group.get(_id)
-        group_dict = model_dictize.group_dictize(group, self.context)
+        organization = utils.org_cache.get(_id)
+        if not organization:
+            abort(404, _('Organization not found'))
+        group_dict = dict(organization)
+        group_dict['package_count'] = model.Session.query(
+            model.Package
+        ).filter_by(owner_org=group_dict['id'], state='active').count()
         group_dict['num_followers'] = logic.get_action('group_follower_count')(
             self.context, data_dict)
         return group_dict
@@ -237,17 +241,44 @@ def download(id, resource_id, filename=None, package_type="dataset"):
         "auth_user_obj": tk.c.userobj,
     }
 
+    # Same as core download view, but resource is served straight from
+    # DB record, without dictization of the whole package
+    access = utils.package_access(id)
+    resource = model.Resource.get(resource_id)
+    if not access or not resource or resource.state != 'active' \
+            or resource.package_id != access['id']:
+        return tk.abort(404, tk._("Resource not found"))
     try:
-        rsc = tk.get_action("resource_show")(context, {"id": resource_id})
-        pkg = tk.get_action("package_show")(context, {"id": id})
-        # Possible NotAuthorized from listeners
-
-        if tk.h.spc_is_restricted(pkg) and context['user']:
-            utils.track_resource_download(context['user'], rsc['id'])
-    except (tk.ObjectNotFound, tk.NotAuthorized):
+        tk.check_access("package_show", context, {"id": access["id"]})
+    except tk.NotAuthorized:
         return tk.abort(404, tk._("Resource not found"))
 
-    return resource_view.download(package_type, id, resource_id, filename)
+    if access['restricted']:
+        try:
+            tk.check_access("restrict_dataset_show", context, {
+                "id": access["id"], "owner_org": access["owner_org"]
+            })
+        except tk.NotAuthorized:
+            # `after_show` hides URLs of restricted resources as well
+            return tk.abort(404, tk._("No download is available"))
+        if context['auth_user_obj']:
+            utils.track_resource_download(
+                context['auth_user_obj'].id, resource.id
+            )
+
+    if resource.url_type == "upload":
+        upload = get_resource_uploader({
+            "id": resource.id,
+            "url": resource.url,
+            "url_type": resource.url_type,
+        })
+        response = send_file(upload.get_path(resource.id))
+        if resource.mimetype:
+            response.headers["Content-Type"] = resource.mimetype
+        return response
+    if not resource.url:
+        return tk.abort(404, tk._("No download is available"))
+    return h.redirect_to(resource.url)
 
 
 @spc_access_request.route("/<package_type>/<id>/download-tracking", defaults={'package_type': 'dataset'})
@@ -260,29 +291,27 @@ def package_download_tracking(id, package_type):
         return tk.abort(403, tk._("Not authorized to read reports"))
     except tk.ObjectNotFound:
         return tk.abort(404, tk._("Dataset not found"))
-    limit = 20
-    page = tk.h.get_page_number(tk.request.args)
-    resp = tk.get_action('spc_download_tracking_list')(context.copy(), {
-        'id': id, 'limit': limit, 'offset': page * limit - limit
-    })
-    params_nopage = dict(
-        [(k, v) for k, v in tk.request.args.items() if k != "page"]
-        + [(k, v) for k, v in tk.request.view_args.items()]
-    )
-
-    pager = h.Page(
-        resp['results'],
-        page=page,
-        item_count=resp['count'],
-        url=partial(tk.h.pager_url, **params_nopage),
-        items_per_page=limit,
-        presliced_list=True
-    )
+    after = tk.request.args.get('after')
+    try:
+        resp = tk.get_action('spc_download_tracking_list')(context.copy(), {
+            'id': id, 'limit': 20, 'after': after
+        })
+    except tk.ValidationError:
+        return tk.abort(400, tk._("Invalid page"))
+
+    next_url = None
+    if resp['next']:
+        next_url = h.url_for(
+            'spc_access_request.package_download_tracking',
+            id=id, package_type=package_type, after=resp['next']
+        )
 
     extra_vars = {
         'pkg_dict': pkg_dict,
-        'pager': pager,
-        'records': resp['results']
+        'records': resp['results'],
+        'count': resp['count'],
+        'next_url': next_url,
+        'is_first_page': not after
     }
     return tk.render('package/spc_download_tracking.html', extra_vars)
 
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+from datetime import datetime
+
+from dateutil import parser
+from flask import Blueprint, Response, stream_with_context
+from six import string_types
+
+import ckan.model as model
+import ckan.plugins.toolkit as tk
+from ckan.common import g, request
+
+from ckanext.spc.model import AccessRequest, DownloadTracking
+
+spc_export = Blueprint('spc_export', __name__)
+
+# rows fetched from DB at once
+_BATCH_SIZE = 1000
+_MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+# spreadsheet applications treat cells starting with these as formulas
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+DOWNLOAD_FIELDS = [
+    'downloaded_at', 'user', 'package_id', 'resource_id', 'resource_name'
+]
+ACCESS_REQUEST_FIELDS = [
+    'id', 'user_id', 'package_id', 'org_id', 'state', 'reason',
+    'data_modified'
+]
+
+
+class _Echo(object):
+    """Pseudo-file, that gives back written value, so CSV rows can be
+    yielded one by one.
+    """
+
+    def write(self, value):
+        return value
+
+
+def _serialize(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _csv_cell(value):
+    value = _serialize(value)
+    if isinstance(value, string_types) and value.startswith(
+            _FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _stream_rows(rows, fields, format):
+    if format == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow(
+                [_csv_cell(getattr(row, field)) for field in fields]
+            )
+    else:
+        for row in rows:
+            yield json.dumps({
+                field: _serialize(getattr(row, field)) for field in fields
+            }) + '\n'
+
+
+def _export(query, fields, name, format):
+    """Stream rows of the `query` as CSV or JSON lines.
+
+    Rows are fetched in batches through server-side cursor, so memory
+    usage doesn't depend on the size of the report.
+    """
+    return Response(
+        stream_with_context(
+            _stream_rows(query.yield_per(_BATCH_SIZE), fields, format)
+        ),
+        mimetype=_MIMETYPES[format],
+        headers={
+            'Content-Disposition': 'attachment; filename={}.{}'.format(
+                name, format
+            )
+        }
+    )
+
+
+def _check_format(format):
+    if format not in _MIMETYPES:
+        return tk.abort(404, tk._('Unknown export format'))
+
+
+def _get_org_or_abort(org_id):
+    org = model.Group.get(org_id)
+    if org is None or not org.is_organization:
+        return tk.abort(404, tk._('Organization not found'))
+    return org
+
+
+def _get_package_or_abort(pkg_id):
+    pkg = model.Package.get(pkg_id)
+    if pkg is None:
+        return tk.abort(404, tk._('Dataset not found'))
+    return pkg
+
+
+def _check_access_or_abort(action, data_dict):
+    try:
+        tk.check_access(action, {'user': g.user}, data_dict)
+    except tk.NotAuthorized:
+        return tk.abort(403, tk._('Not authorized to read reports'))
+
+
+def _date_range():
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        if not start and not end:
+            return None
+        return (
+            parser.parse(start) if start else datetime.min,
+            parser.parse(end) if end else datetime.max,
+        )
+    except (ValueError, OverflowError):
+        return tk.abort(400, tk._('Invalid date range'))
+
+
+@spc_export.route('/organization/<org_id>/access_requests/export.<format>')
+def org_access_requests(org_id, format):
+    _check_format(format)
+    org = _get_org_or_abort(org_id)
+    _check_access_or_abort('manage_access_requests', {'id': org.id})
+
+    query = AccessRequest.get_access_requests_for_org(
+        org.id, request.args.get('state')
+    ).order_by(AccessRequest.data_modified.desc())
+    return _export(
+        query, ACCESS_REQUEST_FIELDS, org.name + '-access-requests', format
+    )
+
+
+@spc_export.route('/dataset/<pkg_id>/access_requests/export.<format>')
+def package_access_requests(pkg_id, format):
+    _check_format(format)
+    pkg = _get_package_or_abort(pkg_id)
+    _check_access_or_abort(
+        'manage_access_requests', {'owner_org': pkg.owner_org}
+    )
+
+    query = AccessRequest.get_access_requests_for_pkg(
+        pkg.id, request.args.get('state')
+    ).order_by(AccessRequest.data_modified.desc())
+    return _export(
+        query, ACCESS_REQUEST_FIELDS, pkg.name + '-access-requests', format
+    )
+
+
+@spc_export.route('/organization/<org_id>/download-tracking/export.<format>')
+def org_download_tracking(org_id, format):
+    _check_format(format)
+    org = _get_org_or_abort(org_id)
+    _check_access_or_abort('manage_access_requests', {'id': org.id})
+
+    query = DownloadTracking.export_query(
+        org_id=org.id, date_range=_date_range()
+    )
+    return _export(query, DOWNLOAD_FIELDS, org.name + '-downloads', format)
+
+
+@spc_export.route('/dataset/<pkg_id>/download-tracking/export.<format>')
+def package_download_tracking(pkg_id, format):
+    _check_format(format)
+    pkg = _get_package_or_abort(pkg_id)
+    _check_access_or_abort('spc_download_tracking_list', {
+        'id': pkg.id, 'owner_org': pkg.owner_org
+    })
+
+    query = DownloadTracking.export_query(
+        package_id=pkg.id, date_range=_date_range()
+    )
+    return _export(query, DOWNLOAD_FIELDS, pkg.name + '-downloads', format)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import json
+from itertools import chain
+
+from flask import Blueprint, Response, stream_with_context
+
+import ckan.plugins.toolkit as tk
+from ckan.common import g, request
+
+from ckanext.spc.logic.action.get import iter_package_search
+
+spc_search = Blueprint('spc_search', __name__)
+
+
+def _stream_results(first, pages):
+    yield '{{"count": {}, "types_count": {}, "results": ['.format(
+        first['count'], json.dumps(first['types_count'])
+    )
+    separator = ''
+    for page in chain([first], pages):
+        for pkg in page['results']:
+            yield separator + json.dumps(pkg)
+            separator = ', '
+    yield ']}'
+
+
+@spc_search.route('/api/spc/package_search/stream')
+def package_search_stream():
+    """Streaming version of `spc_package_search` for full-catalog pulls.
+
+    Accepts the same parameters as `package_search`, except `rows`, `start`
+    and `sort`. Results are sent as soon as each page is fetched.
+    """
+    context = {'user': g.user, 'auth_user_obj': g.userobj}
+    data_dict = request.args.to_dict()
+    data_dict.pop('rows', None)
+
+    # fetch first page right away, so validation and access errors are
+    # reported with the proper status code
+    pages = iter_package_search(context, data_dict)
+    try:
+        first = next(pages)
+    except tk.ValidationError as e:
+        return tk.abort(400, json.dumps(e.error_dict))
+    except tk.NotAuthorized:
+        return tk.abort(403)
+
+    return Response(
+        stream_with_context(_stream_results(first, pages)),
+        mimetype='application/json'
+    )
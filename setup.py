@@ -61,6 +61,10 @@ setup(
       #
       # http://docs.ckan.org/en/latest/extensions/best-practices.html#add-third-party-libraries-to-requirements-txt
     ],
+    extras_require={
+        # simplified EEZ geometries and spatial EEZ lookups
+        'spatial': ['shapely'],
+    },
 
     # If there are data files included in your packages that need to be
     # installed, specify them here.  If using Python 2.6 or less, then these